@@ -0,0 +1,101 @@
+"""
+Vectorized analytics of the collected session snapshots:
+    1. per-session metrics in a single groupby-agg pass
+    2. final risk/mitigation selections of each session
+    3. synthetic snapshots for benchmarks
+
+The functions take the dataframes of the archive (see archive.py) and only
+use the columns that are present, so they also work on partial loads.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from archive import MARKETS, RATINGS, SYSTEMS
+
+
+def session_metrics(snapshots: pd.DataFrame) -> pd.DataFrame:
+    """Return one row per session with its metrics.
+
+    Columns: first_seen, last_seen, duration, duration_seconds, interactions,
+    group (last assigned group), matrix (last viewed matrix), the last
+    before/after ratings and their deltas (delta_<market>_<system>).
+    """
+    # "last" takes the latest value, so the rows must be in time order
+    if not snapshots["timestamp"].is_monotonic_increasing:
+        snapshots = snapshots.sort_values("timestamp", kind="stable")
+    spec = {
+        "first_seen": ("timestamp", "min"),
+        "last_seen": ("timestamp", "max"),
+        "interactions": ("timestamp", "size"),
+    }
+    if "group" in snapshots:
+        # "Select" means no group yet, so it does not count as the last group
+        groups = snapshots["group"].astype(object).where(snapshots["group"] != "Select")
+        snapshots = snapshots.assign(assigned_group=groups)
+        spec["group"] = ("assigned_group", "last")
+    if "matrix" in snapshots:
+        spec["matrix"] = ("matrix", "last")
+    ratings = [column for column in RATINGS if column in snapshots]
+    spec.update({column: (column, "last") for column in ratings})
+
+    metrics = snapshots.groupby("session_id", sort=False, observed=True).agg(**spec)
+    metrics["duration"] = metrics["last_seen"] - metrics["first_seen"]
+    metrics["duration_seconds"] = metrics["duration"].dt.total_seconds()
+    for market in MARKETS:
+        for system in SYSTEMS:
+            before, after = f"before_{market}_{system}", f"after_{market}_{system}"
+            if before in metrics and after in metrics:
+                metrics[f"delta_{market}_{system}"] = metrics[after].astype(
+                    "Int16"
+                ) - metrics[before].astype("Int16")
+    return metrics
+
+
+def final_selections(
+    selections: pd.DataFrame, metrics: pd.DataFrame
+) -> pd.DataFrame:
+    """Return the selections of the last snapshot of each session.
+
+    The result has one row per (session_id, kind, system, item).
+    """
+    last_seen = selections["session_id"].map(metrics["last_seen"])
+    final = selections[selections["timestamp"].values == last_seen.values]
+    return final[["session_id", "kind", "system", "item"]].reset_index(drop=True)
+
+
+def selection_counts(final: pd.DataFrame) -> pd.DataFrame:
+    """Return the number of final selections per session, e.g. risks_s1."""
+    counts = final.groupby(
+        ["session_id", "kind", "system"], observed=True
+    ).size().unstack(["kind", "system"], fill_value=0)
+    counts.columns = [f"{kind}_{system}" for kind, system in counts.columns]
+    return counts
+
+
+def synthetic_snapshots(
+    n_rows: int = 1_000_000, n_sessions: int = 20_000, seed: int = 0
+) -> pd.DataFrame:
+    """Return random snapshots shaped like the archive, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    sessions = rng.integers(0, n_sessions, n_rows)
+    start = np.datetime64("2023-10-04T08:00:00")
+    seconds = rng.integers(0, 8 * 3600, n_rows).astype("timedelta64[s]")
+    df = pd.DataFrame(
+        {
+            "session_id": pd.Categorical(sessions.astype(str)),
+            "timestamp": start + seconds,
+            "group": pd.Categorical.from_codes(
+                rng.integers(0, 8, n_rows),
+                ["Select", "1", "2", "3", "4", "5", "6", "7"],
+            ),
+            "matrix": pd.Categorical.from_codes(
+                rng.integers(0, 3, n_rows), ["Interfaces DSM", "Distance DSM", "Risk DSM"]
+            ),
+        }
+    )
+    for column in RATINGS:
+        df[column] = pd.array(rng.integers(1, 11, n_rows), dtype="Int8")
+    return df.sort_values("timestamp", ignore_index=True)
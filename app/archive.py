@@ -0,0 +1,190 @@
+"""
+Columnar archive of the collected session snapshots:
+    1. rebuilding snapshots from the exported documents or events
+    2. flattening them into typed, dictionary-encoded columns
+    3. exploding the risk/mitigation selections into a side table
+    4. writing both as Parquet datasets partitioned by workshop date
+    5. loading only the needed columns (and dates) for analysis
+
+Usage:
+    python app/archive.py --export collected_data/export --out collected_data/archive
+    python app/archive.py --json collected_data/session_states.json
+
+The archive has two datasets, snapshots/ and selections/, each partitioned
+into date=YYYY-MM-DD folders. Re-ingesting a date replaces its partition.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from events import fold_events
+from export import read_export
+from snapshots import expand_deltas
+
+MARKETS = ["artic", "desert", "special"]
+SYSTEMS = ["s1", "s2", "s3"]
+RATINGS = [
+    f"{phase}_{market}_{system}"
+    for phase in ["before", "after"]
+    for market in MARKETS
+    for system in SYSTEMS
+]
+QUESTIONS = [f"q{i}" for i in range(1, 9)]
+SELECTIONS = [
+    f"{kind}_selected_{system}" for kind in ["risks", "mitigations"] for system in SYSTEMS
+]
+CATEGORIES = ["group", "matrix", "role", "sector"]
+
+
+def snapshots_from_events(documents: list[dict]) -> list[dict]:
+    """Fold the event documents of the session log into one snapshot per rerun.
+
+    The documents must be sorted by session and sequence number (as exported).
+    """
+    snapshots = []
+    states = {}
+    for document in documents:
+        state = states.setdefault(document["session_id"], {})
+        fold_events(document["events"], state)
+        snapshots.append(
+            {
+                **json.loads(json.dumps(state)),
+                "session_id": document["session_id"],
+                "timestamp": document["timestamp"],
+            }
+        )
+    return snapshots
+
+
+def snapshots_from_export(export_dir: str = "collected_data/export") -> list[dict]:
+    """Return the snapshots of every rerun in an export.
+
+    The legacy snapshots (session_states) are followed by the snapshots
+    rebuilt from the event log.
+    """
+    documents = expand_deltas(read_export(export_dir, "session_states"))
+    events = read_export(export_dir, "events")
+    events.sort(key=lambda document: (document["session_id"], document["seq"]))
+    return documents + snapshots_from_events(events)
+
+
+def _scalar(value):
+    """Return None for the empty lists used as defaults of the selectboxes."""
+    return None if isinstance(value, list) else value
+
+
+def flatten(documents: list[dict]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Return the typed snapshots and the exploded selections of the documents."""
+    rows = []
+    selections = []
+    for doc in documents:
+        row = {
+            "session_id": doc.get("session_id"),
+            "timestamp": doc.get("timestamp"),
+            **{column: _scalar(doc.get(column)) for column in CATEGORIES},
+            "experience": _scalar(doc.get("experience")),
+            **{q: doc.get(q) for q in QUESTIONS},
+        }
+        for phase in ["before", "after"]:
+            ratings = doc.get(phase) or {}
+            for market in MARKETS:
+                for system in SYSTEMS:
+                    row[f"{phase}_{market}_{system}"] = ratings.get(f"{market}_{system}")
+        rows.append(row)
+        for field in SELECTIONS:
+            kind, _, system = field.split("_")
+            for item in doc.get(field) or []:
+                selections.append(
+                    {
+                        "session_id": row["session_id"],
+                        "timestamp": row["timestamp"],
+                        "kind": kind,
+                        "system": system,
+                        "item": item,
+                    }
+                )
+
+    columns = ["session_id", "timestamp", *CATEGORIES, "experience", *QUESTIONS]
+    snapshots = pd.DataFrame(rows, columns=columns + RATINGS)
+    snapshots["timestamp"] = pd.to_datetime(snapshots["timestamp"])
+    for column in CATEGORIES:
+        snapshots[column] = snapshots[column].astype("category")
+    snapshots["experience"] = snapshots["experience"].astype("Int16")
+    snapshots[QUESTIONS] = snapshots[QUESTIONS].astype("float32")
+    snapshots[RATINGS] = snapshots[RATINGS].astype("Int8")
+    snapshots["date"] = snapshots["timestamp"].dt.strftime("%Y-%m-%d")
+
+    selections = pd.DataFrame(
+        selections, columns=["session_id", "timestamp", "kind", "system", "item"]
+    )
+    selections["timestamp"] = pd.to_datetime(selections["timestamp"])
+    for column in ["kind", "system", "item"]:
+        selections[column] = selections[column].astype("category")
+    selections["date"] = selections["timestamp"].dt.strftime("%Y-%m-%d")
+    return snapshots, selections
+
+
+def write_dataset(df: pd.DataFrame, path: str):
+    """Write a dataframe as a Parquet dataset partitioned by date."""
+    if df.empty:
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        path,
+        partition_cols=["date"],
+        existing_data_behavior="delete_matching",
+    )
+
+
+def ingest(documents: list[dict], out_dir: str = "collected_data/archive") -> dict:
+    """Write the snapshots and selections of the documents to the archive."""
+    snapshots, selections = flatten(documents)
+    write_dataset(snapshots, os.path.join(out_dir, "snapshots"))
+    write_dataset(selections, os.path.join(out_dir, "selections"))
+    return {"snapshots": len(snapshots), "selections": len(selections)}
+
+
+def load(
+    out_dir: str = "collected_data/archive",
+    dataset: str = "snapshots",
+    columns: list[str] | None = None,
+    dates: list[str] | None = None,
+) -> pd.DataFrame:
+    """Load some columns (and dates) of one of the archive datasets."""
+    filters = [("date", "in", dates)] if dates else None
+    return pd.read_parquet(
+        os.path.join(out_dir, dataset), columns=columns, filters=filters
+    )
+
+
+def load_snapshots(out_dir: str = "collected_data/archive", **kwargs) -> pd.DataFrame:
+    """Load the snapshots dataset."""
+    return load(out_dir, "snapshots", **kwargs)
+
+
+def load_selections(out_dir: str = "collected_data/archive", **kwargs) -> pd.DataFrame:
+    """Load the selections dataset."""
+    return load(out_dir, "selections", **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Parquet archive.")
+    parser.add_argument("--export", default="collected_data/export", help="export folder")
+    parser.add_argument("--json", help="ingest a session_states.json file instead")
+    parser.add_argument("--out", default="collected_data/archive", help="archive folder")
+    args = parser.parse_args()
+
+    if args.json:
+        with open(args.json) as f:
+            documents = json.load(f)
+    else:
+        documents = snapshots_from_export(args.export)
+    print(ingest(documents, args.out))
@@ -0,0 +1,132 @@
+"""
+Binary bundle of the input data:
+    1. hashing the CSV files of the data folder
+    2. compiling the tables to Arrow IPC files and the matrices to .npy files
+    3. memory-mapping a bundle whose hash matches the CSV files
+    4. falling back to the CSV files when the bundle is missing or stale
+
+Usage:
+    python app/bundle.py --data data --out data/bundle
+
+The bundle folder has a manifest.json with the format version, the content
+hash of the CSV files and the file of each table and matrix. Bundles are
+read-only once written, so the memory-mapped pages are shared by all the
+worker processes of the host: the matrices, and the numeric and boolean
+columns of the tables, which are converted to pandas without a copy. The
+string and categorical columns (a few kB) are copied into each process.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from dataset import SOURCES, Dataset, read_sources
+
+VERSION = 5
+MANIFEST = "manifest.json"
+
+
+def source_hash(data_dir: str = "data", hashes: dict | None = None) -> str:
+    """Return the content hash of the CSV files of the data folder.
+
+    The SHA-256 of the files can be given as {file: hex digest}, so the
+    files read for another purpose (see registry.py) are not hashed twice.
+    """
+    digest = hashlib.sha256(f"version={VERSION}".encode())
+    for file in sorted(SOURCES.values()):
+        digest.update(file.encode())
+        if hashes is not None:
+            digest.update(bytes.fromhex(hashes[file]))
+            continue
+        with open(os.path.join(data_dir, file), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def build_bundle(data_dir: str = "data", out_dir: str = "data/bundle") -> dict:
+    """Compile the CSV files into a bundle. Returns its manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    tables, arrays = read_sources(data_dir)
+    manifest = {
+        "version": VERSION,
+        "hash": source_hash(data_dir),
+        "tables": {},
+        "arrays": {},
+    }
+    for name, df in tables.items():
+        file = f"{name}.arrow"
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(os.path.join(out_dir, file), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        manifest["tables"][name] = file
+    for name, array in arrays.items():
+        file = f"{name}.npy"
+        np.save(os.path.join(out_dir, file), np.ascontiguousarray(array))
+        manifest["arrays"][name] = file
+    # The manifest is written last, so a partial build is never loaded
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def read_bundle(out_dir: str = "data/bundle", expected_hash: str | None = None):
+    """Return the memory-mapped tables and matrices of a bundle.
+
+    The numeric columns of the tables and the matrices are read-only views
+    of the mapped files.
+
+    Returns None if the bundle is missing, of another version, or its hash
+    differs from the expected hash.
+    """
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != VERSION:
+        return None
+    if expected_hash is not None and manifest.get("hash") != expected_hash:
+        return None
+    tables = {}
+    for name, file in manifest["tables"].items():
+        source = pa.memory_map(os.path.join(out_dir, file), "r")
+        table = pa.ipc.open_file(source).read_all()
+        # One block per column, so no column is copied to be consolidated
+        tables[name] = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
+    arrays = {
+        name: np.load(os.path.join(out_dir, file), mmap_mode="r")
+        for name, file in manifest["arrays"].items()
+    }
+    return tables, arrays
+
+
+def load_dataset(data_dir: str = "data", out_dir: str = "data/bundle") -> Dataset:
+    """Return the dataset of the bundle, or of the CSV files if it is stale."""
+    bundle = read_bundle(out_dir, source_hash(data_dir))
+    if bundle is None:
+        return Dataset.from_csv(data_dir)
+    tables, arrays = bundle
+    return Dataset(tables, arrays, out_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the binary data bundle.")
+    parser.add_argument("--data", default="data", help="folder of the CSV files")
+    parser.add_argument("--out", default="data/bundle", help="bundle folder")
+    args = parser.parse_args()
+
+    manifest = build_bundle(args.data, args.out)
+    print(
+        f"Bundle {manifest['hash'][:12]}: {len(manifest['tables'])} tables, "
+        f"{len(manifest['arrays'])} matrices in {args.out}"
+    )
@@ -0,0 +1,304 @@
+"""
+Clustering of a DSM into modules:
+    1. Markov clustering (MCL) on sparse matrices, fast
+    2. simulated annealing of the coordination cost, with the cost change of
+       each move computed from the interfaces of the moved component only
+    3. the cost and modularity of a clustering, and the clustered order of
+       the components for the DSM views (see partitioning.Ordering)
+
+The interfaces are taken as undirected: component i and j interact if either
+depends on the other. The coordination cost of a clustering is
+
+    sum over interactions in a cluster c of size(c) ** power
+    + sum over interactions between clusters of size(DSM) ** power
+
+so interactions between clusters are expensive, but so are large clusters
+(one cluster of everything has no interactions between clusters).
+"""
+
+from __future__ import annotations
+
+import math
+import random
+
+import numpy as np
+import scipy.sparse as sp
+
+from dsm import DSM
+from partitioning import Ordering
+
+
+def interactions(matrix: sp.spmatrix) -> sp.csr_matrix:
+    """Return the symmetric 0/1 matrix of the interactions, without diagonal."""
+    coo = sp.coo_matrix(matrix)
+    keep = (coo.row != coo.col) & (coo.data != 0)
+    rows = np.concatenate([coo.row[keep], coo.col[keep]])
+    cols = np.concatenate([coo.col[keep], coo.row[keep]])
+    weights = sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=coo.shape, dtype=np.float64
+    )
+    weights.data[:] = 1.0
+    return weights
+
+
+def compact(labels: np.ndarray) -> np.ndarray:
+    """Return the labels numbered 0, 1, ... in the order of their first component."""
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse]
+
+
+def markov_clusters(
+    weights: sp.csr_matrix,
+    inflation: float = 2.0,
+    prune: float = 1e-4,
+    max_iterations: int = 100,
+    tolerance: float = 1e-6,
+) -> np.ndarray:
+    """Return the cluster of every component with Markov clustering.
+
+    Random walks are expanded (squared) and inflated (cells raised to the
+    inflation, higher for smaller clusters) until they converge; each
+    component joins the attractor that holds most of its flow. The cells
+    below prune are dropped at each step to keep the matrix sparse.
+    """
+    size = weights.shape[0]
+    flow = sp.csc_matrix(weights + sp.identity(size, format="csr"))
+    flow = normalize_columns(flow)
+    for _ in range(max_iterations):
+        last = flow
+        flow = flow @ flow
+        flow = flow.power(inflation)
+        flow.data[flow.data < prune] = 0
+        flow.eliminate_zeros()
+        flow = normalize_columns(flow)
+        if abs(flow - last).max() < tolerance:
+            break
+    attractors = np.asarray(flow.argmax(axis=0)).ravel()
+    return compact(attractors)
+
+
+def normalize_columns(matrix: sp.csc_matrix) -> sp.csc_matrix:
+    """Return the matrix with columns that sum to 1."""
+    sums = np.asarray(matrix.sum(axis=0)).ravel()
+    sums[sums == 0] = 1
+    return sp.csc_matrix(matrix @ sp.diags(1 / sums))
+
+
+def coordination_cost(
+    weights: sp.csr_matrix, labels: np.ndarray, power: float = 2.0
+) -> float:
+    """Return the coordination cost of a clustering (see the module docstring)."""
+    coo = sp.triu(weights, k=1).tocoo()
+    sizes = np.bincount(labels)
+    inside = labels[coo.row] == labels[coo.col]
+    cost = (coo.data[inside] * sizes[labels[coo.row[inside]]] ** power).sum()
+    return float(cost + coo.data[~inside].sum() * weights.shape[0] ** power)
+
+
+def modularity(weights: sp.csr_matrix, labels: np.ndarray) -> float:
+    """Return the modularity of a clustering (0 for random, up to 1)."""
+    total = weights.sum()
+    if total == 0:
+        return 0.0
+    coo = weights.tocoo()
+    inside = labels[coo.row] == labels[coo.col]
+    degrees = np.asarray(weights.sum(axis=1)).ravel()
+    cluster_degrees = np.bincount(labels, weights=degrees)
+    expected = ((cluster_degrees / total) ** 2).sum()
+    return float(coo.data[inside].sum() / total - expected)
+
+
+def anneal(
+    weights: sp.csr_matrix,
+    labels: np.ndarray | None = None,
+    power: float = 2.0,
+    iterations: int | None = None,
+    cooling: float = 1e-3,
+    new_cluster: float = 0.05,
+    seed: int = 0,
+) -> np.ndarray:
+    """Return the cluster of every component with simulated annealing.
+
+    Starting from labels (one cluster per component by default), random
+    components are moved to the cluster of one of their neighbors, or to a
+    new cluster. The cost change of a move only depends on the interactions
+    of the moved component with the two clusters, so a move costs
+    O(interactions of the component). The temperature decreases from one
+    that accepts half of the uphill moves to cooling times that.
+    """
+    rng = random.Random(seed)
+    size = weights.shape[0]
+    iterations = iterations or 20 * size
+    indptr = weights.indptr.tolist()
+    indices = weights.indices.tolist()
+    data = weights.data.tolist()
+    labels = (np.arange(size) if labels is None else np.asarray(labels)).tolist()
+
+    sizes = [0] * size
+    for label in labels:
+        sizes[label] += 1
+    free = [label for label in range(size) if sizes[label] == 0]
+    # Weight of the interactions within each cluster
+    inside = [0.0] * size
+    for i in range(size):
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            if i < j and labels[i] == labels[j]:
+                inside[labels[i]] += data[k]
+    penalty = size**power
+
+    def delta(v: int, target: int) -> tuple[float, float, float]:
+        """Return the cost change of moving v to target, and its weights."""
+        source = labels[v]
+        to_source = to_target = 0.0
+        for k in range(indptr[v], indptr[v + 1]):
+            label = labels[indices[k]]
+            if label == source:
+                to_source += data[k]
+            elif label == target:
+                to_target += data[k]
+        s, t = sizes[source], sizes[target]
+        before = inside[source] * s**power + inside[target] * t**power
+        after = (inside[source] - to_source) * (s - 1) ** power + (
+            inside[target] + to_target
+        ) * (t + 1) ** power
+        change = after - before + (to_source - to_target) * penalty
+        return change, to_source, to_target
+
+    def propose() -> tuple[int, int] | None:
+        """Return a random move (component, target cluster)."""
+        v = rng.randrange(size)
+        if (rng.random() < new_cluster or indptr[v] == indptr[v + 1]) and free:
+            return v, free[-1]
+        if indptr[v] == indptr[v + 1]:
+            return None
+        target = labels[indices[rng.randrange(indptr[v], indptr[v + 1])]]
+        return (v, target) if target != labels[v] else None
+
+    # Starting temperature: half of the uphill moves are accepted
+    uphill = []
+    for _ in range(200):
+        move = propose()
+        if move is not None:
+            change = delta(*move)[0]
+            if change > 0:
+                uphill.append(change)
+    temperature = (float(np.median(uphill)) if uphill else 1.0) / math.log(2)
+    factor = cooling ** (1 / iterations)
+
+    cost = coordination_cost(weights, np.array(labels), power)
+    best, best_labels = cost, list(labels)
+    for iteration in range(iterations):
+        temperature *= factor
+        move = propose()
+        if move is None:
+            continue
+        v, target = move
+        change, to_source, to_target = delta(v, target)
+        if change > 0 and rng.random() >= math.exp(-change / temperature):
+            continue
+        source = labels[v]
+        if sizes[target] == 0:
+            free.pop()
+        inside[source] -= to_source
+        inside[target] += to_target
+        sizes[source] -= 1
+        sizes[target] += 1
+        if sizes[source] == 0:
+            free.append(source)
+        labels[v] = target
+        cost += change
+        # Keeping the best clustering costs O(size), so only check it from
+        # time to time
+        if cost < best and iteration % size == 0:
+            best, best_labels = cost, list(labels)
+    if cost < best:
+        best_labels = labels
+    return compact(np.array(best_labels))
+
+
+class Clustering(Ordering):
+    """The clusters of the components of a DSM, and their clustered order."""
+
+    def __init__(self, matrix: sp.spmatrix, labels: np.ndarray):
+        """Initialize the clustering of a DSM given as a sparse matrix of marks.
+
+        The clusters are numbered in the order of their first component, and
+        ordered so in the clustered order.
+        """
+        self.weights = interactions(matrix)
+        labels = compact(np.asarray(labels))
+        super().__init__(labels, np.lexsort((np.arange(len(labels)), labels)))
+
+    def __repr__(self):
+        """Return a string representation of the clustering."""
+        return (
+            f"Clustering({self.size} components, {self.count} clusters, "
+            f"{self.between()} interactions between clusters, "
+            f"modularity {self.modularity():.3f})"
+        )
+
+    @classmethod
+    def markov(cls, matrix: sp.spmatrix, **kwargs) -> Clustering:
+        """Return the Markov clustering of a DSM (see markov_clusters)."""
+        return cls(matrix, markov_clusters(interactions(matrix), **kwargs))
+
+    @classmethod
+    def annealed(
+        cls, matrix: sp.spmatrix, labels: np.ndarray | None = None, **kwargs
+    ) -> Clustering:
+        """Return the clustering of a DSM by simulated annealing (see anneal)."""
+        return cls(matrix, anneal(interactions(matrix), labels, **kwargs))
+
+    @classmethod
+    def from_dsm(
+        cls, dsm: DSM, method: str = "markov", kinds=None, **kwargs
+    ) -> Clustering:
+        """Return a clustering ("markov" or "annealed") of the interfaces of a DSM."""
+        matrix = dsm.layer(kinds)
+        if method == "markov":
+            return cls.markov(matrix, **kwargs)
+        if method == "annealed":
+            return cls.annealed(matrix, **kwargs)
+        raise ValueError(f"Unknown clustering method {method!r}")
+
+    def between(self) -> int:
+        """Return the number of interactions between clusters."""
+        coo = sp.triu(self.weights, k=1).tocoo()
+        return int((self.labels[coo.row] != self.labels[coo.col]).sum())
+
+    def cost(self, power: float = 2.0) -> float:
+        """Return the coordination cost of the clustering."""
+        return coordination_cost(self.weights, self.labels, power)
+
+    def modularity(self) -> float:
+        """Return the modularity of the clustering."""
+        return modularity(self.weights, self.labels)
+
+
+def synthetic(
+    clusters: int = 100,
+    size: int = 50,
+    inside: float = 0.2,
+    between: float = 2.0,
+    seed: int = 0,
+) -> tuple[DSM, np.ndarray]:
+    """Return a random block-structured DSM and its true clusters.
+
+    Two components of the same cluster interact with probability inside, and
+    each component has about between interactions with random components.
+    """
+    rng = np.random.default_rng(seed)
+    count = clusters * size
+    truth = np.repeat(np.arange(clusters), size)
+    pairs = int(count * size * inside)
+    rows = rng.integers(0, count, pairs)
+    cols = truth[rows] * size + rng.integers(0, size, pairs)
+    noise = int(count * between)
+    rows = np.concatenate([rows, rng.integers(0, count, noise)])
+    cols = np.concatenate([cols, rng.integers(0, count, noise)])
+    keep = rows != cols
+    kinds = np.full(keep.sum(), "M")
+    return DSM.from_edges(count, rows[keep], cols[keep], kinds), truth
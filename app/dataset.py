@@ -0,0 +1,182 @@
+"""
+Shared input data of the app:
+    1. reading the CSV files of the data folder once per process, typed
+       and validated with the schemas of schema.py
+    2. exposing the matrices as read-only numpy arrays
+    3. giving each session its own copy of the (editable) systems table
+
+The CSV files can also be compiled into a binary bundle (see bundle.py).
+
+The Dataset is loaded with st.cache_resource in main.py, so all sessions and
+reruns share the same object. Its dataframes must not be modified in place;
+use systems_copy() for the table that the sessions edit.
+"""
+
+from __future__ import annotations
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMAS, apply_schema, parse_links
+
+SYSTEMS = ["s1", "s2", "s3"]
+
+TABLES = {
+    "components": "Components.csv",
+    "tech_risks": "TechRisks.csv",
+    "mitigations": "Mitigations.csv",
+    "systems": "Systems.csv",
+}
+# The rows of the risk matrices are not the components of Components.csv:
+# their labels are read from the Excel exports (RISK_LABELS)
+MATRICES = {
+    f"risk_{system}": os.path.join("risk", f"{system}_risk.csv") for system in SYSTEMS
+}
+CPM_MATRICES = {
+    f"{system}_{domain}_{measure}": os.path.join(
+        "risk", f"{system}_{domain}_{measure}.csv"
+    )
+    for system in SYSTEMS
+    for domain in ["force", "electro", "thermo"]
+    for measure in ["likelihood", "impact"]
+}
+KIND_MATRICES = {"dsm": "dsm.csv"}
+RISK_LABELS = {
+    f"risk_labels_{system}": os.path.join("risk", f"{system}_risk.xlsx")
+    for system in SYSTEMS
+}
+SOURCES = {**TABLES, **MATRICES, **CPM_MATRICES, **KIND_MATRICES}
+
+
+def read_csv(path: str, **kwargs) -> pd.DataFrame:
+    """Return a dataframe of a CSV file of the data folder."""
+    return pd.read_csv(path, sep=";", decimal=",", **kwargs)
+
+
+def read_matrix(path: str) -> np.ndarray:
+    """Return a square matrix without header, with empty cells as 0."""
+    return read_csv(path, index_col=False, header=None).fillna(0).to_numpy(np.float64)
+
+
+def read_kind_matrix(path: str) -> np.ndarray:
+    """Return a DSM of interface kinds ("M", "E", ...), with "" for no interface."""
+    df = read_csv(path, index_col=False, header=None, dtype=str)
+    return df.fillna("").to_numpy(dtype="U1")
+
+
+def read_cpm_matrix(path: str) -> np.ndarray:
+    """Return a likelihood/impact matrix exported by CPM, with empty cells as 0.
+
+    The files are comma-separated, with a header row, label columns up to
+    "HIERARCHY ID" and a trailing comma on every line.
+    """
+    df = pd.read_csv(path, na_values=[" "], index_col=False)
+    start = list(df.columns).index("HIERARCHY ID") + 1
+    df = df.iloc[:, start : start + len(df)]
+    return df.fillna(0).to_numpy(np.float64)
+
+
+def read_risk_labels(path: str) -> list[str]:
+    """Return the component names of a risk matrix, from its Excel export.
+
+    The names are the text cells of the first row, in the order of the rows
+    and columns of the matrix (which differs from Components.csv).
+    """
+    df = pd.read_excel(path, header=None, nrows=1)
+    return [value.strip() for value in df.iloc[0] if isinstance(value, str)]
+
+
+def type_tables(tables: dict) -> dict:
+    """Return the tables with the dtypes of their schemas (see schema.py)."""
+    typed = dict(tables)
+    typed["components"] = apply_schema("components", tables["components"])
+    ids = typed["components"]["id"].to_numpy()
+    for name in SCHEMAS:
+        if name != "components":
+            typed[name] = apply_schema(name, tables[name], ids)
+    return typed
+
+
+def read_source(data_dir: str, name: str, component_ids=None):
+    """Return the typed table or the matrix of one CSV file of a data folder.
+
+    The component ids are needed to parse the links of the mitigations.
+    """
+    path = os.path.join(data_dir, SOURCES[name])
+    if name in MATRICES:
+        return read_matrix(path)
+    if name in CPM_MATRICES:
+        return read_cpm_matrix(path)
+    if name in KIND_MATRICES:
+        return read_kind_matrix(path)
+    df = read_csv(path)
+    if name not in SCHEMAS:
+        return df
+    return apply_schema(name, df, component_ids)
+
+
+def read_sources(data_dir: str = "data") -> tuple[dict, dict]:
+    """Return the typed tables and matrices of the CSV files of a data folder."""
+    tables = {"components": read_source(data_dir, "components")}
+    ids = tables["components"]["id"].to_numpy()
+    for name in TABLES:
+        if name != "components":
+            tables[name] = read_source(data_dir, name, ids)
+    arrays = {
+        name: read_source(data_dir, name) for name in SOURCES if name not in TABLES
+    }
+    return tables, arrays
+
+
+def read_only(array: np.ndarray) -> np.ndarray:
+    """Return a read-only view of an array."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def component_positions(components: pd.DataFrame) -> np.ndarray:
+    """Return the read-only (n, 3) positions of the components, in mm."""
+    return read_only(components[["x", "y", "z"]].to_numpy(dtype=np.float64))
+
+
+class Dataset:
+    """The input data of the app, loaded once and shared by all sessions."""
+
+    def __init__(self, tables: dict, arrays: dict, source: str = "data"):
+        """Initialize the dataset from the raw tables and matrices.
+
+        Use Dataset.from_csv(), or bundle.load_dataset() to read a bundle.
+        """
+        self.source = source
+        self.arrays = {name: read_only(array) for name, array in arrays.items()}
+
+        self.components = tables["components"]
+        self.dsm = pd.DataFrame(self.arrays["dsm"], copy=False)
+        self.tech_risks = tables["tech_risks"]
+        self.mitigations = tables["mitigations"]
+        self.systems = tables["systems"]
+        # Component ids of the A/B links of the mitigations (see schema.Links)
+        ids = self.components["id"].to_numpy()
+        self.links = {
+            column: parse_links(self.mitigations[column], ids) for column in "AB"
+        }
+
+        self.dsm_array = self.arrays["dsm"]
+        self.positions = component_positions(self.components)
+
+    def __repr__(self):
+        """Return a string representation of the dataset."""
+        return f"Dataset({self.source}, {len(self.components)} components)"
+
+    @classmethod
+    def from_csv(cls, data_dir: str = "data") -> Dataset:
+        """Return the dataset of the CSV files of a data folder."""
+        tables, arrays = read_sources(data_dir)
+        return cls(tables, arrays, data_dir)
+
+    def systems_copy(self) -> pd.DataFrame:
+        """Return a copy of the systems table for a session to edit."""
+        return self.systems.copy()
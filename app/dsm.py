@@ -0,0 +1,194 @@
+"""
+Multi-layer sparse DSM:
+    1. one boolean CSR matrix per interface kind (M, E, I, H)
+    2. building it from a matrix of kind letters or from edge lists
+    3. vectorized neighbors, degrees and per-kind filters
+    4. submatrices (e.g. per system) and unions of DSMs
+    5. synthetic DSMs for benchmarks
+
+Cell (i, j) of a layer is True if component i has an interface of that kind
+with component j. Memory and query time scale with the number of interfaces,
+not with the square of the number of components.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import scipy.sparse as sp
+
+KINDS = {
+    "M": "mechanical",
+    "E": "electrical",
+    "I": "information",
+    "H": "hydraulic",
+}
+
+
+class DSM:
+    """A sparse DSM with one CSR layer per interface kind."""
+
+    def __init__(self, layers: dict, names: list | None = None):
+        """Initialize the DSM from {kind: sparse matrix} layers of equal shape."""
+        shapes = {layer.shape for layer in layers.values()}
+        if len(shapes) != 1:
+            raise ValueError(f"Layers of different shapes: {shapes}")
+        (shape,) = shapes
+        if shape[0] != shape[1]:
+            raise ValueError(f"A DSM must be square, not {shape}")
+        self.layers = {
+            kind: sp.csr_matrix(layer, dtype=bool) for kind, layer in layers.items()
+        }
+        for layer in self.layers.values():
+            layer.eliminate_zeros()
+        self.names = list(names) if names is not None else list(range(shape[0]))
+        self._unions = {}
+
+    def __repr__(self):
+        """Return a string representation of the DSM."""
+        counts = ", ".join(f"{kind}={layer.nnz}" for kind, layer in self.layers.items())
+        return f"DSM({self.size} components, {counts})"
+
+    def __len__(self):
+        """Return the number of components."""
+        return self.size
+
+    def __or__(self, other: DSM) -> DSM:
+        """Return the union of two DSMs of the same components."""
+        return self.union(other)
+
+    @property
+    def size(self) -> int:
+        """Number of components."""
+        return next(iter(self.layers.values())).shape[0]
+
+    @property
+    def nnz(self) -> int:
+        """Number of interfaces (of all kinds)."""
+        return sum(layer.nnz for layer in self.layers.values())
+
+    @classmethod
+    def from_kinds(cls, matrix: np.ndarray, names: list | None = None) -> DSM:
+        """Return the DSM of a matrix of kind letters ("" for no interface)."""
+        matrix = np.asarray(matrix)
+        rows, cols = np.nonzero(matrix != "")
+        return cls.from_edges(len(matrix), rows, cols, matrix[rows, cols], names)
+
+    @classmethod
+    def from_edges(
+        cls,
+        size: int,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        kinds: np.ndarray,
+        names: list | None = None,
+    ) -> DSM:
+        """Return the DSM of (row, col, kind) interfaces."""
+        rows, cols, kinds = np.asarray(rows), np.asarray(cols), np.asarray(kinds)
+        unknown = set(np.unique(kinds)) - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown interface kinds {sorted(unknown)}")
+        layers = {}
+        for kind in KINDS:
+            mask = kinds == kind
+            layers[kind] = sp.csr_matrix(
+                (np.ones(mask.sum(), dtype=bool), (rows[mask], cols[mask])),
+                shape=(size, size),
+            )
+        return cls(layers, names)
+
+    def layer(self, kinds=None, transpose: bool = False) -> sp.csr_matrix:
+        """Return the union of some kinds (all by default) as one CSR matrix.
+
+        The unions are cached, as the DSM is not modified after it is built.
+        """
+        key = (tuple(sorted(self.layers if kinds is None else kinds)), transpose)
+        if key not in self._unions:
+            if transpose:
+                union = self.layer(kinds).T.tocsr()
+            else:
+                union = sp.csr_matrix((self.size, self.size), dtype=bool)
+                for kind in key[0]:
+                    union = union + self.layers[kind]
+            self._unions[key] = union
+        return self._unions[key]
+
+    def edges(self, kinds=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the (rows, cols, kinds) arrays of the interfaces, row-major."""
+        kinds = list(self.layers) if kinds is None else list(kinds)
+        rows, cols, letters = [], [], []
+        for kind in kinds:
+            coo = self.layers[kind].tocoo()
+            rows.append(coo.row)
+            cols.append(coo.col)
+            letters.append(np.full(coo.nnz, kind))
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        letters = np.concatenate(letters).astype("U1")
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order], letters[order]
+
+    def neighbors(self, i: int, kinds=None, direction: str = "out") -> np.ndarray:
+        """Return the sorted indices of the components connected to component i.
+
+        The direction is "out" (row i), "in" (column i) or "both".
+        """
+        found = []
+        if direction in ("out", "both"):
+            matrix = self.layer(kinds)
+            found.append(matrix.indices[matrix.indptr[i] : matrix.indptr[i + 1]])
+        if direction in ("in", "both"):
+            matrix = self.layer(kinds, transpose=True)
+            found.append(matrix.indices[matrix.indptr[i] : matrix.indptr[i + 1]])
+        return np.unique(np.concatenate(found))
+
+    def degree(self, kinds=None, direction: str = "out") -> np.ndarray:
+        """Return the number of neighbors of every component.
+
+        With direction "both", a neighbor in both directions counts once.
+        """
+        if direction == "out":
+            return np.diff(self.layer(kinds).indptr)
+        if direction == "in":
+            return np.diff(self.layer(kinds, transpose=True).indptr)
+        return (self.layer(kinds) + self.layer(kinds, transpose=True)).getnnz(axis=1)
+
+    def filter(self, kinds) -> DSM:
+        """Return the DSM with only some kinds of interfaces."""
+        return DSM({kind: self.layers[kind] for kind in kinds}, self.names)
+
+    def submatrix(self, indices) -> DSM:
+        """Return the DSM of some components (e.g. those of one system)."""
+        indices = np.asarray(indices)
+        layers = {
+            kind: layer[indices][:, indices] for kind, layer in self.layers.items()
+        }
+        return DSM(layers, [self.names[i] for i in indices])
+
+    def union(self, other: DSM) -> DSM:
+        """Return the union of two DSMs of the same components."""
+        if other.size != self.size:
+            raise ValueError(f"Cannot unite DSMs of {self.size} and {other.size}")
+        layers = dict(self.layers)
+        for kind, layer in other.layers.items():
+            layers[kind] = layers[kind] + layer if kind in layers else layer
+        return DSM(layers, self.names)
+
+    def to_kinds(self) -> np.ndarray:
+        """Return the dense matrix of kind letters ("" for no interface)."""
+        matrix = np.full((self.size, self.size), "", dtype="U1")
+        rows, cols, kinds = self.edges()
+        matrix[rows, cols] = kinds
+        return matrix
+
+    @classmethod
+    def synthetic(
+        cls, size: int = 10_000, degree: float = 6.0, seed: int = 0
+    ) -> DSM:
+        """Return a random DSM with about degree interfaces per component."""
+        rng = np.random.default_rng(seed)
+        n = int(size * degree)
+        rows = rng.integers(0, size, n)
+        # Mostly local interfaces, as in a real assembly
+        cols = np.clip(rows + rng.integers(-50, 51, n), 0, size - 1)
+        keep = rows != cols
+        kinds = rng.choice(list(KINDS), n, p=[0.6, 0.15, 0.05, 0.2])
+        return cls.from_edges(size, rows[keep], cols[keep], kinds[keep])
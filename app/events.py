@@ -0,0 +1,160 @@
+"""
+Event-sourced log of the workshop sessions:
+    1. deriving small typed events from the snapshot deltas
+    2. merging the changed fields into the session document and appending
+       one event document per rerun
+    3. folding the events back into the session state
+    4. reading and deleting the log of a session
+
+Each session has a document in the "sessions" collection with its latest
+materialized state, and one document per rerun with the list of its events
+in the "events" collection. A rerun only writes the fields that changed to
+the session document (the storage backends merge them into it). Event
+document IDs are "<session_id>_<seq>" with a zero-padded, monotonic sequence
+number, so the log of a session is a prefix scan over the document IDs.
+
+Event types:
+    start: the first snapshot of the session (value is the full state)
+    set: a field changed (nested fields are dotted, e.g. "before.artic_s2")
+    added / removed: an item was added to or removed from a list field
+"""
+
+import copy
+
+from snapshots import SnapshotDiffer
+from storage import Storage
+
+SESSIONS = "sessions"
+EVENTS = "events"
+# Full snapshots "<session_id>_<timestamp>" written before the event log
+SESSION_STATES = "session_states"
+
+
+def event_id(session_id: str, seq: int) -> str:
+    """Return the document ID of an event."""
+    return f"{session_id}_{seq:06d}"
+
+
+def events_from_delta(previous: dict | None, delta: dict) -> list[dict]:
+    """Return the events that turn the previous state into previous + delta."""
+    if previous is None:
+        return [{"type": "start", "value": copy.deepcopy(delta)}]
+    events = []
+    for field, value in delta.items():
+        old = previous.get(field)
+        if isinstance(value, dict):
+            for key, item in value.items():
+                events.append({"type": "set", "field": f"{field}.{key}", "value": item})
+        elif isinstance(value, list) and isinstance(old, list):
+            events.extend(
+                {"type": "removed", "field": field, "value": item}
+                for item in old
+                if item not in value
+            )
+            events.extend(
+                {"type": "added", "field": field, "value": item}
+                for item in value
+                if item not in old
+            )
+        else:
+            events.append({"type": "set", "field": field, "value": value})
+    return events
+
+
+def fold_events(events: list[dict], state: dict | None = None) -> dict:
+    """Apply events (sorted by seq) to a state and return it."""
+    state = {} if state is None else state
+    for event in events:
+        kind = event["type"]
+        if kind == "start":
+            state.clear()
+            state.update(copy.deepcopy(event["value"]))
+            continue
+        field, _, key = event["field"].partition(".")
+        if kind == "set" and key:
+            state.setdefault(field, {})[key] = event["value"]
+        elif kind == "set":
+            state[field] = event["value"]
+        elif kind == "added":
+            state.setdefault(field, []).append(event["value"])
+        elif kind == "removed" and event["value"] in state.get(field, []):
+            state[field].remove(event["value"])
+    return state
+
+
+class SessionLog:
+    """The event log of a single session."""
+
+    def __init__(self, session_id: str):
+        """Initialize an empty log."""
+        self.session_id = session_id
+        self.seq = 0
+        self.first_seen = None
+        self.differ = SnapshotDiffer()
+        self._pending = None
+
+    def __repr__(self):
+        """Return a string representation of the log."""
+        return f"SessionLog({self.session_id}, seq={self.seq})"
+
+    def record(self, snapshot: dict, timestamp: str) -> list[tuple[str, str, dict]]:
+        """Return the writes that persist a snapshot, or [] if nothing changed.
+
+        The writes are the event document of the rerun and the changed fields
+        of the session document. The log only advances when commit() is
+        called, e.g. once the writes have been queued for upload.
+        """
+        delta = self.differ.diff(snapshot)
+        if not delta:
+            self._pending = None
+            return []
+        seq = self.seq + 1
+        header = {"session_id": self.session_id, "timestamp": timestamp, "seq": seq}
+        session = {**copy.deepcopy(delta), **header}
+        if self.first_seen is None:
+            session["first_seen"] = timestamp
+        writes = [
+            (
+                EVENTS,
+                event_id(self.session_id, seq),
+                {**header, "events": events_from_delta(self.differ.last, delta)},
+            ),
+            (SESSIONS, self.session_id, session),
+        ]
+        self._pending = (delta, self.first_seen or timestamp)
+        return writes
+
+    def commit(self):
+        """Advance the log past the writes returned by the last record()."""
+        if self._pending is None:
+            return
+        delta, first_seen = self._pending
+        self.differ.commit(delta)
+        self.seq += 1
+        self.first_seen = first_seen
+        self._pending = None
+
+
+def read_events(storage: Storage, session_id: str) -> list[dict]:
+    """Return the events of a session sorted by sequence number."""
+    return [
+        event
+        for _, data in storage.stream(EVENTS, prefix=f"{session_id}_")
+        for event in data["events"]
+    ]
+
+
+def delete_session(storage: Storage, session_id: str) -> int:
+    """Delete the session document, its events and its legacy snapshots.
+
+    Returns the number of deleted event documents and snapshots.
+    """
+    count = 0
+    for collection in (EVENTS, SESSION_STATES):
+        prefix = f"{session_id}_"
+        documents = [document for document, _ in storage.stream(collection, prefix)]
+        for start in range(0, len(documents), 500):
+            storage.delete(collection, documents[start : start + 500])
+        count += len(documents)
+    storage.delete(SESSIONS, [session_id])
+    return count
@@ -0,0 +1,359 @@
+"""
+Incremental export of the collected data:
+    1. keeping a high-water-mark cursor per collection
+    2. fetching only the new documents with paginated queries
+    3. splitting the time range into partitions read in parallel
+    4. appending the documents to a local Parquet store
+
+Usage:
+    python app/export.py --out collected_data/export --key firestore-key.json
+
+Every run writes one part file per collection with the documents after the
+cursor, e.g. collected_data/export/events/part-20231004T150000.parquet, and
+then advances the cursor in collected_data/export/cursor.json. Each row has
+the document ID, session_id, timestamp and the document data as JSON.
+Documents exported more than once are deduplicated by document ID when the
+store is read. A deleted session is purged from the part files and recorded
+in collected_data/export/deleted.json, so its documents are not exported or
+read again.
+
+The cursor is on the commit time set by the storage backend (COMMITTED), not
+on the timestamp of the rerun: a document that reaches the backend late (a
+spool replay, a batch retried after an outage) has a late commit time, so it
+sorts after the cursor. The lookback window fetches the last minutes before
+the cursor again, for the commits that become visible after later ones.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from storage import COMMITTED, COMMITTED_FORMAT, Storage, open_storage
+
+COLLECTIONS = ("session_states", "sessions", "events")
+FIELD = COMMITTED
+# Timestamp of the rerun, in local time: the cursor field of the first exports
+TIMESTAMP = "timestamp"
+FORMATS = {COMMITTED: COMMITTED_FORMAT, TIMESTAMP: "%Y-%m-%d %H:%M:%S"}
+# Seconds before the cursor fetched again by default
+LOOKBACK = 300.0
+# Sessions deleted from the export
+TOMBSTONES = "deleted.json"
+
+SCHEMA = pa.schema(
+    [
+        ("document", pa.string()),
+        ("session_id", pa.string()),
+        ("timestamp", pa.string()),
+        ("data", pa.string()),
+    ]
+)
+
+
+def read_cursors(path: str) -> dict:
+    """Return the cursors of the previous export by field, {} for a first export.
+
+    The cursor files of the exports on the rerun timestamps, with the cursors
+    of the collections only, are read as cursors on TIMESTAMP.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        cursors = json.load(f)
+    if not set(cursors) <= set(FORMATS):
+        return {TIMESTAMP: cursors}
+    return cursors
+
+
+def write_cursors(path: str, cursors: dict):
+    """Write the cursors atomically."""
+    with open(path + ".tmp", "w") as f:
+        json.dump(cursors, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_tombstones(out_dir: str) -> set[str]:
+    """Return the IDs of the sessions deleted from the export."""
+    path = os.path.join(out_dir, TOMBSTONES)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f))
+
+
+def delete_session(out_dir: str, session_id: str) -> int:
+    """Delete a session from the export. Returns the number of purged rows.
+
+    The session is recorded as deleted first, then its rows are removed from
+    the part files (the parts left empty are removed).
+    """
+    deleted = read_tombstones(out_dir) | {session_id}
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, TOMBSTONES)
+    with open(path + ".tmp", "w") as f:
+        json.dump(sorted(deleted), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+    purged = 0
+    for collection in os.listdir(out_dir):
+        directory = os.path.join(out_dir, collection)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".parquet"):
+                continue
+            part = os.path.join(directory, name)
+            table = pq.read_table(part)
+            keep = pc.invert(
+                pc.fill_null(pc.equal(table["session_id"], session_id), False)
+            )
+            kept = table.filter(keep)
+            if kept.num_rows == table.num_rows:
+                continue
+            purged += table.num_rows - kept.num_rows
+            if kept.num_rows:
+                pq.write_table(kept, part + ".tmp")
+                os.replace(part + ".tmp", part)
+            else:
+                os.remove(part)
+    return purged
+
+
+def fetch_range(
+    storage: Storage,
+    collection: str,
+    start=None,
+    after: tuple | None = None,
+    end=None,
+    page_size: int = 500,
+    field: str = FIELD,
+) -> list[tuple[str, dict]]:
+    """Fetch all documents of a range, one page (start_after query) at a time."""
+    documents = []
+    while True:
+        page = storage.query(collection, field, start, after, end, page_size)
+        documents.extend(page)
+        if len(page) < page_size:
+            return documents
+        after = (page[-1][1][field], page[-1][0])
+
+
+def split_range(start: str, end: str, partitions: int, field: str = FIELD) -> list[str]:
+    """Split [start, end) into time boundaries of equal length."""
+    time_format = FORMATS[field]
+    t0 = datetime.datetime.strptime(start, time_format)
+    t1 = datetime.datetime.strptime(end, time_format)
+    step = (t1 - t0) / partitions
+    bounds = [(t0 + i * step).strftime(time_format) for i in range(partitions)]
+    return sorted(set(bounds)) + [end]
+
+
+def current_time(field: str = FIELD) -> datetime.datetime:
+    """Return the current time, in UTC for the commit times."""
+    if field == COMMITTED:
+        return datetime.datetime.now(datetime.timezone.utc)
+    return datetime.datetime.now()
+
+
+def fetch_new(
+    storage: Storage,
+    collection: str,
+    cursor: tuple | None,
+    partitions: int = 8,
+    page_size: int = 500,
+    lookback: float = LOOKBACK,
+    now: datetime.datetime | None = None,
+    field: str = FIELD,
+) -> list[tuple[str, dict]]:
+    """Fetch the documents after the cursor, reading time partitions in parallel.
+
+    With a lookback (in seconds), the documents of that window before the
+    cursor are fetched again, to catch the commits that became visible late.
+    """
+    time_format = FORMATS[field]
+    if cursor is None:
+        first = storage.query(collection, field, limit=1)
+        if not first:
+            return []
+        start = first[0][1][field]
+    elif lookback:
+        t0 = datetime.datetime.strptime(cursor[0], time_format)
+        start = (t0 - datetime.timedelta(seconds=lookback)).strftime(time_format)
+        cursor = None
+    else:
+        start = cursor[0]
+    # The last partition is open-ended, so documents written during the
+    # export are either fetched now or by the next export
+    now = now or current_time(field)
+    end = max(start, now.strftime(time_format))
+    bounds = (
+        split_range(start, end, partitions, field) if partitions > 1 else [start, end]
+    )
+    ranges = [
+        (bounds[i], bounds[i + 1] if i + 2 < len(bounds) else None)
+        for i in range(len(bounds) - 1)
+    ] or [(start, None)]
+
+    def fetch(i):
+        lower, upper = ranges[i]
+        # The cursor only applies to the first partition
+        after = tuple(cursor) if (cursor is not None and i == 0) else None
+        return fetch_range(storage, collection, lower, after, upper, page_size, field)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        results = list(executor.map(fetch, range(len(ranges))))
+    return [document for result in results for document in result]
+
+
+def write_part(out_dir: str, collection: str, documents: list[tuple[str, dict]]) -> str:
+    """Append the documents to the Parquet store of a collection."""
+    directory = os.path.join(out_dir, collection)
+    os.makedirs(directory, exist_ok=True)
+    name = datetime.datetime.now().strftime("part-%Y%m%dT%H%M%S%f.parquet")
+    table = pa.table(
+        {
+            "document": [document for document, _ in documents],
+            "session_id": [data.get("session_id") for _, data in documents],
+            "timestamp": [data.get(TIMESTAMP) for _, data in documents],
+            "data": [json.dumps(data, default=str) for _, data in documents],
+        },
+        schema=SCHEMA,
+    )
+    path = os.path.join(directory, name)
+    pq.write_table(table, path)
+    return path
+
+
+def export(
+    storage: Storage,
+    out_dir: str,
+    collections: tuple[str, ...] = COLLECTIONS,
+    partitions: int = 8,
+    page_size: int = 500,
+    lookback: float = LOOKBACK,
+) -> dict:
+    """Export the new documents of each collection. Returns the counts.
+
+    A cursor on the rerun timestamps (of an older export) is replaced by a
+    commit time cursor: the documents after the old cursor and all the
+    committed documents are exported once (the duplicates are dropped on read).
+    A first export also fetches the documents on their rerun timestamps, so the
+    documents written before the commit times were set are exported too.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cursor_path = os.path.join(out_dir, "cursor.json")
+    cursors = read_cursors(cursor_path)
+    deleted = read_tombstones(out_dir)
+    counts = {}
+    for collection in collections:
+        cursor = cursors.get(FIELD, {}).get(collection)
+        documents = fetch_new(
+            storage, collection, cursor, partitions, page_size, lookback
+        )
+        old_cursor = cursors.get(TIMESTAMP, {}).pop(collection, None)
+        if old_cursor is not None or cursor is None:
+            # The documents committed before the commit times were set (all
+            # of them for a first export, as they have no commit time)
+            documents += fetch_new(
+                storage,
+                collection,
+                old_cursor,
+                partitions,
+                page_size,
+                lookback,
+                field=TIMESTAMP,
+            )
+        # The documents with both fields are fetched twice
+        documents = list(dict(documents).items())
+        exported = [
+            (document, data)
+            for document, data in documents
+            if data.get("session_id") not in deleted
+        ]
+        counts[collection] = len(exported)
+        if exported:
+            write_part(out_dir, collection, exported)
+        if documents:
+            committed = [
+                (data[FIELD], document)
+                for document, data in documents
+                if FIELD in data
+            ]
+            if committed:
+                cursor = max(list(max(committed)), cursor or [])
+                cursors.setdefault(FIELD, {})[collection] = cursor
+            elif cursor is None:
+                # Only documents without a commit time: the next export goes
+                # on from the last rerun timestamp
+                last = max((data[TIMESTAMP], document) for document, data in documents)
+                old_cursor = max(list(last), old_cursor or [])
+                cursors.setdefault(TIMESTAMP, {})[collection] = old_cursor
+        if documents or old_cursor is not None:
+            if not cursors.get(TIMESTAMP, True):
+                del cursors[TIMESTAMP]
+            write_cursors(cursor_path, cursors)
+    return counts
+
+
+def read_export(out_dir: str, collection: str) -> list[dict]:
+    """Return the exported documents of a collection, sorted by rerun timestamp.
+
+    Documents exported more than once (e.g. overwritten session documents)
+    are returned once, with their latest data. The deleted sessions are left
+    out.
+    """
+    directory = os.path.join(out_dir, collection)
+    if not os.path.isdir(directory):
+        return []
+    deleted = read_tombstones(out_dir)
+    latest = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".parquet"):
+            path = os.path.join(directory, name)
+            table = pq.read_table(path, columns=["document", "session_id", "data"])
+            for document, session_id, data in zip(
+                table["document"].to_pylist(),
+                table["session_id"].to_pylist(),
+                table["data"].to_pylist(),
+            ):
+                if session_id not in deleted:
+                    latest[document] = data
+    documents = [json.loads(data) for data in latest.values()]
+    return sorted(documents, key=lambda data: data.get(TIMESTAMP) or "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the new collected data.")
+    parser.add_argument("--out", default="collected_data/export", help="output folder")
+    parser.add_argument("--backend", default="firestore", help="storage backend")
+    parser.add_argument("--key", default="firestore-key.json", help="service account key")
+    parser.add_argument("--path", default="storage.sqlite3", help="SQLite storage file")
+    parser.add_argument("--collection", action="append", help="collections to export")
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument(
+        "--lookback", type=float, default=LOOKBACK, help="seconds to fetch again"
+    )
+    args = parser.parse_args()
+
+    storage = open_storage(
+        {"backend": args.backend, "key_file": args.key, "path": args.path}
+    )
+    counts = export(
+        storage,
+        args.out,
+        tuple(args.collection or COLLECTIONS),
+        args.partitions,
+        args.page_size,
+        args.lookback,
+    )
+    for collection, count in counts.items():
+        print(f"{collection}: {count} documents exported")
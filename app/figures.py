@@ -0,0 +1,348 @@
+"""
+Matrix figures of the systems, rendered from the data:
+    1. the Interfaces, Distance and Risk DSMs of a system as plotly heatmaps,
+       in the order of the data, partitioned or clustered
+    2. a process-wide LRU cache of the figures, keyed by (system, matrix,
+       order, content hash of the input files)
+    3. zooming into the Interfaces DSM of the large systems: the level of
+       detail pyramid is cached, and each window is drawn from it
+    4. building the cached figures of a new version of the data
+
+The figures replace the PNG files exported by hand (assets/s1_interfaces.png,
+...). A figure is built once per version of its input files and shared by all
+sessions, so switching matrices or systems is a cache hit after the first
+time, and an edit of the data shows up on the next rerun. The figures in use
+are built for a new version before it is swapped in (see warm_figures).
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from systems import system_key
+
+# Colors of the interface kinds, as in the ragraph styles of main.py
+KIND_COLORS = {
+    "M": "#de9c38",
+    "E": "#a64747",
+    "I": "#545a8e",
+    "H": "#389dfc",
+}
+DIAGONAL_COLOR = "#7f7f7f"
+CELL_SIZE = 28
+# Larger systems are drawn without labels, with levels of detail (heatmap.py)
+LOD_SIZE = 200
+
+
+class FigureCache:
+    """A thread-safe LRU cache of figures."""
+
+    def __init__(self, maxsize: int = 32):
+        """Initialize an empty cache of at most maxsize figures."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a string representation of the cache."""
+        return (
+            f"FigureCache({len(self._figures)}/{self.maxsize} figures, "
+            f"{self.hits} hits, {self.misses} misses)"
+        )
+
+    def __len__(self):
+        """Return the number of cached figures."""
+        return len(self._figures)
+
+    def get(self, key: tuple, build: Callable):
+        """Return the figure of a key, building it with build() on a miss."""
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return self._figures[key]
+        figure = build()
+        with self._lock:
+            self.misses += 1
+            self._figures[key] = figure
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+        return figure
+
+    def keys(self) -> list[tuple]:
+        """Return the keys of the cached figures, least recently used first."""
+        with self._lock:
+            return list(self._figures)
+
+    def clear(self):
+        """Remove all the figures."""
+        with self._lock:
+            self._figures.clear()
+
+
+def matrix_layout(figure, names: list, numbered: bool = False):
+    """Set the layout of a square matrix with the component names as rows.
+
+    The columns are numbered if numbered, else labelled with the names.
+    """
+    size = len(names)
+    positions = list(range(size))
+    columns = [str(i + 1) for i in positions] if numbered else names
+    figure.update_layout(
+        height=CELL_SIZE * size + (80 if numbered else 260),
+        margin=dict(l=10, r=10, t=80 if numbered else 260, b=10),
+        plot_bgcolor="white",
+    )
+    figure.update_xaxes(
+        side="top",
+        tickmode="array",
+        tickvals=positions,
+        ticktext=columns,
+        tickangle=0 if numbered else -45,
+        showgrid=False,
+        constrain="domain",
+    )
+    figure.update_yaxes(
+        tickmode="array",
+        tickvals=positions,
+        ticktext=[
+            f"{name} ({i + 1})" if numbered else name for i, name in enumerate(names)
+        ],
+        autorange="reversed",
+        showgrid=False,
+        scaleanchor="x",
+        constrain="domain",
+    )
+    return figure
+
+
+def interfaces_figure(names: list, kinds: np.ndarray):
+    """Return the Interfaces DSM of a matrix of kind letters."""
+    import plotly.graph_objects as go
+
+    from dsm import KINDS
+
+    # One code per kind, the diagonal last, and no cell for no interface
+    codes = np.full(kinds.shape, np.nan)
+    for code, kind in enumerate(KINDS, start=1):
+        codes[kinds == kind] = code
+    text = kinds.astype(object)
+    diagonal = np.arange(len(names))
+    codes[diagonal, diagonal] = len(KINDS) + 1
+    text[diagonal, diagonal] = [str(i + 1) for i in diagonal]
+
+    colors = [KIND_COLORS[kind] for kind in KINDS] + [DIAGONAL_COLOR]
+    colorscale = []
+    for i, color in enumerate(colors):
+        colorscale += [[i / len(colors), color], [(i + 1) / len(colors), color]]
+    figure = go.Figure(
+        go.Heatmap(
+            z=codes,
+            text=text,
+            texttemplate="%{text}",
+            colorscale=colorscale,
+            zmin=0.5,
+            zmax=len(colors) + 0.5,
+            showscale=False,
+            xgap=1,
+            ygap=1,
+            hovertemplate="%{y} → %{x}: %{text}<extra></extra>",
+        )
+    )
+    for kind, name in KINDS.items():
+        figure.add_trace(
+            go.Scatter(
+                x=[None],
+                y=[None],
+                mode="markers",
+                marker=dict(size=12, symbol="square", color=KIND_COLORS[kind]),
+                name=f"{kind}: {name}",
+            )
+        )
+    figure.update_layout(legend=dict(orientation="h", y=1.0, yanchor="bottom"))
+    return matrix_layout(figure, names, numbered=True)
+
+
+def values_figure(
+    names: list, values: np.ndarray, colorscale: str, decimals: int, unit: str = ""
+):
+    """Return a DSM of values (distances, risks), with an empty diagonal."""
+    import plotly.graph_objects as go
+
+    values = np.array(values, dtype=float)
+    np.fill_diagonal(values, np.nan)
+    figure = go.Figure(
+        go.Heatmap(
+            z=values,
+            x=list(range(len(names))),
+            y=list(range(len(names))),
+            texttemplate=f"%{{z:.{decimals}f}}",
+            colorscale=colorscale,
+            showscale=False,
+            xgap=1,
+            ygap=1,
+            customdata=np.array(
+                [[(row, column) for column in names] for row in names], dtype=object
+            ),
+            hovertemplate=(
+                f"%{{customdata[0]}} → %{{customdata[1]}}: %{{z:.{decimals}f}}{unit}"
+                "<extra></extra>"
+            ),
+        )
+    )
+    return matrix_layout(figure, names)
+
+
+def system_names(data: dict, system: str) -> list[str]:
+    """Return the names of the components of a system."""
+    return list(data["system_index"].component_table(system)["name"].str.strip())
+
+
+def system_ordering(data: dict, system: str, order: str):
+    """Return the ordering of the components of a system (None for "data").
+
+    The order is "partitioned" (see partitioning.py) or "clustered" (see
+    clustering.py), from the interfaces of the system.
+    """
+    if order == "data":
+        return None
+    index = data["system_index"]
+    interfaces = index.interfaces(data["interfaces"], system)
+    if order == "partitioned":
+        from partitioning import Partition
+
+        return Partition.from_dsm(interfaces)
+    if order == "clustered":
+        from clustering import Clustering
+
+        return Clustering.from_dsm(interfaces)
+    raise ValueError(f"Unknown order {order!r}")
+
+
+def system_pyramid(data: dict, system: str, order: str = "data") -> tuple:
+    """Return the levels of detail of the Interfaces DSM of a system, and names."""
+    from heatmap import Pyramid
+
+    names = system_names(data, system)
+    interfaces = data["system_index"].interfaces(data["interfaces"], system)
+    ordering = system_ordering(data, system, order)
+    if ordering is not None:
+        interfaces = ordering.apply_dsm(interfaces)
+        names = ordering.ordered(names)
+    return Pyramid.from_dsm(interfaces), names
+
+
+def system_interfaces(data: dict, system: str, order: str = "data"):
+    """Return the Interfaces DSM of a system (the overview for a large one)."""
+    index = data["system_index"]
+    names = system_names(data, system)
+    if len(names) > LOD_SIZE:
+        pyramid, names = system_pyramid(data, system, order)
+        return pyramid.figure(names=names)
+    ordering = system_ordering(data, system, order)
+    kinds = index.matrix("dsm", system)
+    if ordering is not None:
+        names, kinds = ordering.ordered(names), ordering.apply(kinds)
+    return interfaces_figure(names, kinds)
+
+
+def system_distances(data: dict, system: str, order: str = "data"):
+    """Return the Distance DSM of a system, in mm."""
+    names = system_names(data, system)
+    distances = data["system_index"].distances(data["geometry"], system)
+    ordering = system_ordering(data, system, order)
+    if ordering is not None:
+        names, distances = ordering.ordered(names), ordering.apply(distances)
+    return values_figure(names, distances, "RdBu", 0, " mm")
+
+
+def system_risk(data: dict, system: str, order: str = "data"):
+    """Return the Risk DSM (propagation of risks) of a system."""
+    names = data[f"risk_labels_{system}"]
+    risk = data["dataset"].arrays[f"risk_{system}"]
+    ordering = system_ordering(data, system, order)
+    if ordering is not None:
+        # The risk matrix has its own order of the components
+        permutation = ordering.reorder(system_names(data, system), names)
+        names = [names[i] for i in permutation]
+        risk = risk[np.ix_(permutation, permutation)]
+    return values_figure(names, risk, "RdYlGn_r", 2)
+
+
+# Figure builders and input files of each matrix
+MATRIX_FIGURES = {
+    "Interfaces DSM": (system_interfaces, lambda system: ["components", "dsm"]),
+    "Distance DSM": (system_distances, lambda system: ["components"]),
+    "Risk DSM": (
+        system_risk,
+        lambda system: [f"risk_{system}", f"risk_labels_{system}"],
+    ),
+}
+# Orders of the components in the figures
+ORDERS = {
+    "data": "As in the data",
+    "partitioned": "Partitioned",
+    "clustered": "Clustered",
+}
+
+
+def zoom_size(data: dict, system: str, matrix: str) -> int:
+    """Return the number of components of a matrix with levels of detail, or 0.
+
+    Only the Interfaces DSM of the systems larger than LOD_SIZE can be zoomed
+    into (see matrix_figure).
+    """
+    if matrix != "Interfaces DSM":
+        return 0
+    size = len(data["system_index"].component_table(system))
+    return size if size > LOD_SIZE else 0
+
+
+def matrix_figure(
+    cache: FigureCache,
+    data: dict,
+    system: str,
+    matrix: str,
+    order: str = "data",
+    window: tuple[int, int] | None = None,
+):
+    """Return the figure of a matrix ("Interfaces DSM", ...) of a system.
+
+    The data is a registry snapshot, whose file hashes key the cache. The
+    partitioned and clustered orders also depend on the interfaces (dsm.csv).
+    A matrix with levels of detail (see zoom_size) shows the (start, stop)
+    window of its components, all by default: the pyramid is cached and the
+    window drawn from it at the finest level that fits.
+    """
+    system = system_key(system)
+    build, inputs = MATRIX_FIGURES[matrix]
+    names = set(inputs(system))
+    if order != "data":
+        names |= {"components", "dsm"}
+    key = (system, matrix, order, data.hash(names))
+    if zoom_size(data, system, matrix):
+        pyramid, labels = cache.get(
+            key + ("pyramid",), lambda: system_pyramid(data, system, order)
+        )
+        return pyramid.figure(window, window, names=labels)
+    return cache.get(key, lambda: build(data, system, order))
+
+
+def warm_figures(cache: FigureCache, data: dict) -> int:
+    """Build the figures of the cached matrices for a version of the data.
+
+    The data is a registry snapshot, e.g. of a reload (see Registry.on_reload).
+    The figures whose input files did not change are cache hits. Returns the
+    number of figures built.
+    """
+    misses = cache.misses
+    for system, matrix, order in dict.fromkeys(key[:3] for key in cache.keys()):
+        matrix_figure(cache, data, system, matrix, order)
+    return cache.misses - misses
@@ -0,0 +1,112 @@
+"""
+Geometry of the components, from their x/y/z coordinates in Components.csv:
+    1. pairwise distances, in condensed (upper triangle) float32 form
+    2. distances of some pairs and per-system distance matrices
+    3. a KD-tree for "components within r mm of X" queries
+
+The distances are computed on load instead of being read from a precomputed
+file, so they always match the coordinates. The condensed form holds each
+pair once: n * (n - 1) / 2 values instead of n * n. It is only computed when
+used; the KD-tree answers radius queries without it, for large assemblies.
+"""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+
+from dataset import read_only
+
+
+class Geometry:
+    """Distances and spatial index of the component positions."""
+
+    def __init__(self, positions: np.ndarray):
+        """Initialize the geometry of an (n, 3) array of positions in mm."""
+        positions = np.asarray(positions, dtype=np.float64)
+        if positions.ndim != 2 or positions.shape[1] != 3:
+            raise ValueError(f"Positions must be (n, 3), not {positions.shape}")
+        self.positions = read_only(positions)
+        self._condensed = None
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a string representation of the geometry."""
+        return f"Geometry({self.size} components)"
+
+    def __len__(self):
+        """Return the number of components."""
+        return self.size
+
+    @property
+    def size(self) -> int:
+        """Number of components."""
+        return len(self.positions)
+
+    @property
+    def condensed(self) -> np.ndarray:
+        """Pairwise distances (i < j, row-major) as a read-only float32 array."""
+        if self._condensed is None:
+            from scipy.spatial.distance import pdist
+
+            with self._lock:
+                if self._condensed is None:
+                    distances = pdist(self.positions).astype(np.float32)
+                    self._condensed = read_only(distances)
+        return self._condensed
+
+    @property
+    def tree(self):
+        """KD-tree of the positions, built on first use."""
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+
+            with self._lock:
+                if self._tree is None:
+                    self._tree = cKDTree(self.positions)
+        return self._tree
+
+    def condensed_index(self, i, j) -> np.ndarray:
+        """Return the positions of pairs (i, j), i != j, in the condensed array."""
+        i, j = np.asarray(i), np.asarray(j)
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        n = self.size
+        return n * i - i * (i + 1) // 2 + j - i - 1
+
+    def distance(self, i, j) -> np.ndarray:
+        """Return the exact distances of pairs of components (0 if i == j)."""
+        delta = self.positions[np.asarray(i)] - self.positions[np.asarray(j)]
+        return np.sqrt(np.einsum("...k,...k->...", delta, delta))
+
+    def submatrix(self, indices=None) -> np.ndarray:
+        """Return the square float32 distance matrix of some (or all) components."""
+        indices = np.arange(self.size) if indices is None else np.asarray(indices)
+        i, j = np.meshgrid(indices, indices, indexing="ij")
+        matrix = np.zeros(i.shape, dtype=np.float32)
+        off = i != j
+        matrix[off] = self.condensed[self.condensed_index(i[off], j[off])]
+        return matrix
+
+    def within(self, center, radius: float) -> np.ndarray:
+        """Return the sorted indices of the components within radius mm.
+
+        The center is a component index (which is left out) or a point.
+        """
+        if np.ndim(center) == 0:
+            found = self.tree.query_ball_point(self.positions[center], radius)
+            found = np.array(sorted(found), dtype=np.intp)
+            return found[found != center]
+        found = self.tree.query_ball_point(np.asarray(center, np.float64), radius)
+        return np.array(sorted(found), dtype=np.intp)
+
+    def pairs_within(self, radius: float) -> np.ndarray:
+        """Return the (i, j), i < j, pairs of components within radius mm."""
+        return self.tree.query_pairs(radius, output_type="ndarray")
+
+    @classmethod
+    def synthetic(cls, size: int = 10_000, extent: float = 5_000.0, seed: int = 0):
+        """Return a random geometry of size components in a cube of extent mm."""
+        rng = np.random.default_rng(seed)
+        return cls(rng.uniform(-extent / 2, extent / 2, (size, 3)))
@@ -0,0 +1,237 @@
+"""
+Heatmaps of large DSMs with levels of detail:
+    1. a pyramid of the matrix aggregated in blocks (sum, max or kind mask),
+       built once per matrix
+    2. picking the level that keeps the number of cells of a view bounded
+    3. plotly heatmaps of a view: blocks when zoomed out, cells when zoomed in
+
+The ragraph mdm plots draw a shape per cell, which does not scale past a few
+hundred components. A plotly heatmap draws its cells as one image, so its
+cost is the number of cells sent to the browser. Each level of the pyramid
+aggregates factor x factor blocks of the level below, and a view takes the
+finest level that has at most max_cells blocks per side: the render time
+stays flat as the DSM grows.
+
+All the levels are sparse, so the pyramid of a DSM takes memory in the
+number of interfaces. Cell (i, j) of level k aggregates the cells of rows
+i * factor**k to (i + 1) * factor**k - 1 (and the same for the columns).
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import scipy.sparse as sp
+
+from dsm import DSM, KINDS
+from figures import KIND_COLORS
+
+# Aggregation of the cells of a block
+AGGREGATIONS = {
+    "sum": np.add,
+    "max": np.maximum,
+    "kinds": np.bitwise_or,
+}
+# Bit of each interface kind in a kind mask
+KIND_BITS = {kind: 1 << i for i, kind in enumerate(KINDS)}
+MIXED_COLOR = "#404040"
+# Largest window with the kind letters of each cell on hover
+HOVER_CELLS = 10_000
+
+
+def reduce_blocks(
+    rows: np.ndarray, cols: np.ndarray, values: np.ndarray, size: int, aggregate
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the (rows, cols, values) with the duplicate cells aggregated."""
+    if len(values) == 0:
+        return rows, cols, values
+    keys = rows.astype(np.int64) * size + cols
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    values = aggregate.reduceat(values[order], starts)
+    keys = keys[starts]
+    return keys // size, keys % size, values
+
+
+class Pyramid:
+    """The levels of detail of a square matrix, as sparse matrices."""
+
+    def __init__(
+        self,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+        size: int,
+        aggregation: str = "sum",
+        factor: int = 2,
+        min_size: int = 64,
+    ):
+        """Initialize the pyramid of the non-zero cells of a matrix.
+
+        Levels are added until the coarsest one has at most min_size blocks
+        per side.
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation {aggregation!r}")
+        self.size = size
+        self.aggregation = aggregation
+        self.factor = factor
+        aggregate = AGGREGATIONS[aggregation]
+        rows, cols, values = reduce_blocks(
+            np.asarray(rows), np.asarray(cols), np.asarray(values), size, aggregate
+        )
+        self.levels = []
+        side = size
+        while True:
+            self.levels.append(
+                sp.csr_matrix((values, (rows, cols)), shape=(side, side))
+            )
+            if side <= min_size:
+                break
+            side = -(-side // factor)
+            rows, cols, values = reduce_blocks(
+                rows // factor, cols // factor, values, side, aggregate
+            )
+
+    def __repr__(self):
+        """Return a string representation of the pyramid."""
+        return (
+            f"Pyramid({self.size} x {self.size}, {self.aggregation}, "
+            f"{len(self.levels)} levels)"
+        )
+
+    @classmethod
+    def from_dense(cls, matrix: np.ndarray, aggregation: str = "max", **kwargs):
+        """Return the pyramid of a dense matrix (e.g. distances or risks)."""
+        matrix = np.asarray(matrix)
+        rows, cols = np.nonzero(np.nan_to_num(matrix))
+        return cls(rows, cols, matrix[rows, cols], len(matrix), aggregation, **kwargs)
+
+    @classmethod
+    def from_dsm(cls, dsm: DSM, aggregation: str = "kinds", **kwargs):
+        """Return the pyramid of a DSM: its kind masks, or interface counts."""
+        rows, cols, kinds = dsm.edges()
+        if aggregation == "kinds":
+            values = np.zeros(len(kinds), dtype=np.uint8)
+            for kind, bit in KIND_BITS.items():
+                values[kinds == kind] = bit
+        else:
+            values = np.ones(len(kinds), dtype=np.int32)
+        return cls(rows, cols, values, dsm.size, aggregation, **kwargs)
+
+    def block(self, level: int) -> int:
+        """Return the number of rows (and columns) of a block of a level."""
+        return self.factor**level
+
+    def level_for(self, span: int, max_cells: int = 512) -> int:
+        """Return the finest level with at most max_cells blocks over span rows."""
+        for level in range(len(self.levels)):
+            if -(-span // self.block(level)) <= max_cells:
+                return level
+        return len(self.levels) - 1
+
+    def view(self, rows=None, cols=None, max_cells: int = 512) -> tuple:
+        """Return (cells, level, first row, first column) of a window.
+
+        The window is given by (start, stop) component indices of the rows
+        and columns (all by default). The cells are a dense array of the
+        blocks of the level: uint8 kind masks (0 if empty), or float32 with
+        NaN for the empty blocks.
+        """
+        rows = rows or (0, self.size)
+        cols = cols or (0, self.size)
+        span = max(rows[1] - rows[0], cols[1] - cols[0])
+        level = self.level_for(span, max_cells)
+        block = self.block(level)
+        r0, r1 = rows[0] // block, -(-rows[1] // block)
+        c0, c1 = cols[0] // block, -(-cols[1] // block)
+        window = self.levels[level][r0:r1, c0:c1]
+        if self.aggregation == "kinds":
+            cells = np.zeros(window.shape, dtype=np.uint8)
+        else:
+            cells = np.full(window.shape, np.nan, dtype=np.float32)
+        coo = window.tocoo()
+        cells[coo.row, coo.col] = coo.data
+        return cells, level, r0 * block, c0 * block
+
+    def figure(
+        self,
+        rows=None,
+        cols=None,
+        max_cells: int = 512,
+        names: list | None = None,
+        colorscale: str = "Viridis",
+    ):
+        """Return the plotly heatmap of a window (see view()).
+
+        The axes are in component indices, so a zoomed-in range can be passed
+        back as the next window. Names label the rows of small windows.
+        """
+        import plotly.graph_objects as go
+
+        cells, level, row, col = self.view(rows, cols, max_cells)
+        block = self.block(level)
+        trace = dict(
+            z=cells,
+            x0=col + (block - 1) / 2,
+            dx=block,
+            y0=row + (block - 1) / 2,
+            dy=block,
+            hoverongaps=False,
+        )
+        if self.aggregation == "kinds":
+            trace.update(
+                colorscale=kind_colorscale(),
+                zmin=-0.5,
+                zmax=2 ** len(KINDS) - 0.5,
+                showscale=False,
+            )
+            # Kind letters on hover, if they do not outweigh the cells
+            if cells.size <= HOVER_CELLS:
+                trace.update(
+                    customdata=kind_labels(cells),
+                    hovertemplate="%{y} → %{x}: %{customdata}<extra></extra>",
+                )
+        else:
+            trace.update(colorscale=colorscale)
+        figure = go.Figure(go.Heatmap(**trace))
+        title = "cells" if block == 1 else f"blocks of {block} x {block} cells"
+        figure.update_layout(title=f"Level {level}: {title}", plot_bgcolor="white")
+        figure.update_xaxes(side="top", showgrid=False, constrain="domain")
+        figure.update_yaxes(
+            autorange="reversed", showgrid=False, scaleanchor="x", constrain="domain"
+        )
+        if names is not None and block == 1 and len(cells) <= 60:
+            figure.update_yaxes(
+                tickmode="array",
+                tickvals=list(range(row, row + len(cells))),
+                ticktext=names[row : row + len(cells)],
+            )
+        return figure
+
+
+def kind_colorscale() -> list:
+    """Return the discrete colorscale of the kind masks (0 to 2**kinds - 1).
+
+    A mask of one kind has the color of the kind, a mask of several kinds
+    the mixed color.
+    """
+    count = 2 ** len(KINDS)
+    colors = {bit: KIND_COLORS[kind] for kind, bit in KIND_BITS.items()}
+    colorscale = []
+    for mask in range(count):
+        color = colors.get(mask, MIXED_COLOR if mask else "white")
+        colorscale += [[mask / count, color], [(mask + 1) / count, color]]
+    return colorscale
+
+
+def kind_labels(cells: np.ndarray) -> np.ndarray:
+    """Return the kind letters ("M", "MH", ...) of an array of kind masks."""
+    names = np.array(
+        [
+            "".join(kind for kind, bit in KIND_BITS.items() if mask & bit)
+            for mask in range(2 ** len(KINDS))
+        ],
+        dtype=object,
+    )
+    return names[cells.astype(int)]
@@ -10,24 +10,28 @@ This app helps the participants of the DSM Industry Sprint Workshop.
 from __future__ import annotations
 
 import datetime
-import json
+import logging
 import pandas as pd
 import numpy as np
 import streamlit as st
 from streamlit import runtime
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit import session_state as ss
-import plotly.express as px
-from google.cloud import firestore
-from google.oauth2 import service_account
-import seaborn as sns
-from ragraph.graph import Graph
-from ragraph.node import Node
-from ragraph.edge import Edge
-from ragraph import plot
-from ragraph.colors import (
-    get_diverging_redblue,
-)
+
+# Heavy modules (plotly, seaborn) are imported where they are used,
+# so the first screen (the Info expander) renders without loading them.
+# Profile the import cost with `python app/profiling.py`.
+from events import SessionLog
+from figures import ORDERS, FigureCache, matrix_figure, warm_figures, zoom_size
+from registry import Registry, data_registry
+from render_matrices import image_path
+from spool import Spool
+from storage import Storage, open_storage
+from systems import system_key
+from upload_policy import UploadPolicy
+from upload_queue import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
 
 ###############################################################################
 # Formatting
@@ -79,17 +83,48 @@ st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 ###############################################################################
 
 
-# Authenticate to Firestore
+def get_config(section: str) -> dict:
+    """Returns a section of the app secrets, or an empty dict if it is not set."""
+    try:
+        return dict(st.secrets.get(section, {}))
+    except Exception:
+        return {}
+
+
+# Storage backend for the collected data
+@st.cache_resource
+def get_storage() -> Storage:
+    """Returns the storage backend selected by the [storage] secrets.
+
+    Firestore (the default) authenticates with the "textkey" secret, the
+    "memory" and "sqlite" backends need no credentials.
+    """
+    config = get_config("storage")
+    if config.get("backend", "firestore") == "firestore" and "key" not in config:
+        config["key"] = st.secrets["textkey"]
+    return open_storage(config)
+
+
+# Queue the session state uploads so that reruns do not wait for the storage
 @st.cache_resource
-def authenticate_to_firestore():
-    """Authenticates to Firestore and returns a client."""
-    key_dict = json.loads(st.secrets["textkey"])
-    creds = service_account.Credentials.from_service_account_info(key_dict)
-    db = firestore.Client(credentials=creds, project="dsm2023isw")
-    return db
+def get_upload_queue():
+    """Returns the process-wide write-behind queue for session states.
+
+    The documents are spooled locally first (see the [spool] secrets), so
+    they are kept when the storage is unreachable or the app runs offline.
+    """
+    config = get_config("spool")
+    spool = None
+    if config.get("enabled", True):
+        spool = Spool(config.get("path", "spool.sqlite3"))
+    storage = None if config.get("offline", False) else get_storage()
+    return WriteBehindQueue(storage, spool=spool)
 
 
-db = authenticate_to_firestore()
+upload_queue = get_upload_queue()
+
+# Decide which reruns are persisted, from the [upload_policy] secrets
+upload_policy = UploadPolicy.from_config(get_config("upload_policy"))
 
 
 # Disable SettingWithCopyWarning from pandas
@@ -101,9 +136,23 @@ pd.options.mode.chained_assignment = None  # default='warn'
 systems_colors = ["#264653", "#E9C46A", "#E76F51"]  # , "#2A9D8F", "#F4A261", "#E63946"]
 markets_colors = ["#3A86FF", "#FF006E", "#8338EC"]
 
+
 # dataframe colors
-cm_g2r = sns.diverging_palette(130, 12, as_cmap=True)
-cm_r2g = sns.diverging_palette(12, 130, as_cmap=True)
+@st.cache_resource
+def get_colormaps():
+    """Returns the green-to-red and red-to-green colormaps of the tables."""
+    import seaborn as sns
+
+    cm_g2r = sns.diverging_palette(130, 12, as_cmap=True)
+    cm_r2g = sns.diverging_palette(12, 130, as_cmap=True)
+    return cm_g2r, cm_r2g
+
+
+# matrix figures, shared by all sessions
+@st.cache_resource
+def get_figure_cache():
+    """Returns the process-wide cache of the matrix figures."""
+    return FigureCache(get_config("figures").get("cache_size", 32))
 
 
 ###############################################################################
@@ -348,6 +397,53 @@ def calculate_ms(new_df: pd.DataFrame | None = None):
     # st.rerun()
 
 
+def get_session_snapshot() -> dict:
+    """Returns the session state data that is persisted to the database."""
+    return {
+        "role": ss.role,
+        "sector": ss.sector,
+        "experience": ss.experience,
+        "group": ss.group,
+        "risks_selected_s1": ss.risks_selected_s1,
+        "risks_selected_s2": ss.risks_selected_s2,
+        "risks_selected_s3": ss.risks_selected_s3,
+        "mitigations_selected_s1": ss.mitigations_selected_s1,
+        "mitigations_selected_s2": ss.mitigations_selected_s2,
+        "mitigations_selected_s3": ss.mitigations_selected_s3,
+        "matrix": ss.matrix,
+        "q1": ss.q1,
+        "q2": ss.q2,
+        "q3": ss.q3,
+        "q4": ss.q4,
+        "q5": ss.q5,
+        "q6": ss.q6,
+        "q7": ss.q7,
+        "q8": ss.q8,
+        "before": {
+            "artic_s1": ss.before_artic_s1,
+            "artic_s2": ss.before_artic_s2,
+            "artic_s3": ss.before_artic_s3,
+            "desert_s1": ss.before_desert_s1,
+            "desert_s2": ss.before_desert_s2,
+            "desert_s3": ss.before_desert_s3,
+            "special_s1": ss.before_special_s1,
+            "special_s2": ss.before_special_s2,
+            "special_s3": ss.before_special_s3,
+        },
+        "after": {
+            "artic_s1": ss.after_artic_s1,
+            "artic_s2": ss.after_artic_s2,
+            "artic_s3": ss.after_artic_s3,
+            "desert_s1": ss.after_desert_s1,
+            "desert_s2": ss.after_desert_s2,
+            "desert_s3": ss.after_desert_s3,
+            "special_s1": ss.after_special_s1,
+            "special_s2": ss.after_special_s2,
+            "special_s3": ss.after_special_s3,
+        },
+    }
+
+
 ###############################################################################
 # Import data
 ###############################################################################
@@ -362,59 +458,44 @@ if "system" not in ss:
     ss.system = None
 
 
-@st.cache_data
-def get_data(csv_file):
-    return pd.read_csv(csv_file, sep=";", decimal=",")
+@st.cache_resource
+def get_registry() -> Registry:
+    """Returns the registry of the input data, shared by all sessions.
+
+    The files are watched in the background (see the [data] secrets): when
+    one changes, the values that depend on it and the cached figures are
+    rebuilt and swapped in.
+    """
+    config = get_config("data")
+    registry = data_registry(
+        config.get("path", "data"), config.get("bundle", "data/bundle")
+    )
+    if config.get("reload", True):
+        figure_cache = get_figure_cache()
+        registry.on_reload(lambda values: warm_figures(figure_cache, values))
+        registry.watch(config.get("reload_interval", 2.0))
+    return registry
+
 
+# All values of one rerun come from the same version of the data
+data = get_registry().snapshot()
+dataset = data["dataset"]
+systems = data["system_index"]
 
 # Import data from data/Components.csv into dataframe
-# df_components = pd.read_csv("data/Components.csv", sep=";", decimal=",")
-df_components = get_data("data/Components.csv")
+df_components = dataset.components
 # Components per system
 # df_components_s1 = df_components[df_components["s1"] == True]
 # df_components_s2 = df_components[df_components["s2"] == True]
 # df_components_s3 = df_components[df_components["s3"] == True]
 
 # DSMs
-# df_dsm = pd.read_csv("data/dsm.csv", sep=";", header=None, decimal=",").fillna(0)
-df_dsm = get_data("data/dsm.csv").fillna(0)
+df_dsm = dataset.dsm
 
 # Distances
-# df_distances = pd.read_csv("data/distances.csv", sep=";", header=None, decimal=",").fillna(0)
-df_distances = pd.read_csv(
-    "data/distances.csv", index_col=False, header=None, sep=";", decimal=","
-).fillna(0)
-
-
-# Combined risks from CPM
-df_risk_s1 = pd.read_csv(
-    "data/risk/s1_risk.csv", index_col=False, header=None, sep=";", decimal=","
-).fillna(0)
-# df_risk_s1.columns = df_components[df_components["s1"] == True]['name']
-df_risk_s1.insert(0, "id", df_components[df_components["s1"] == True]["name"])
-
-df_risk_s2 = pd.read_csv(
-    "data/risk/s2_risk.csv", index_col=False, header=None, sep=";", decimal=","
-).fillna(0)
-# df_risk_s2.columns = df_components[df_components["s2"] == True]['name']
-df_risk_s2.insert(0, "id", df_components[df_components["s2"] == True]["name"])
-
-df_risk_s3 = pd.read_csv(
-    "data/risk/s3_risk.csv", index_col=False, header=None, sep=";", decimal=","
-).fillna(0)
-# df_risk_s3.columns = df_components[df_components["s3"] == True]['name']
-df_risk_s3.insert(0, "id", df_components[df_components["s3"] == True]["name"])
-
-# Kinds of interfaces
-kinds = {
-    "M": "mechanical",
-    "E": "electrical",
-    "I": "information",
-    "H": "hydraulic",
-}
 
 # Import data from data/Risks.csv into dataframe
-df_risks = get_data("data/TechRisks.csv")
+df_risks = dataset.tech_risks
 
 if (
     "risks_selected_s1" not in ss
@@ -429,73 +510,13 @@ if (
 if "fig" not in ss:
     ss.fig = None
 
-if "g" not in ss:
-    ss.g = Graph()
-
-    for component in df_components.iterrows():
-        # print(f'id: {component[1]["id"]} name:{component[1]["name"]}')
-        systems_full_names = {
-            "s1": "System 1",
-            "s2": "System 2",
-            "s3": "System 3",
-        }
-        labels = [
-            systems_full_names[s] for s in ["s1", "s2", "s3"] if component[1][s] == True
-        ]
-        fancy_node = Node(
-            name=component[1]["name"],
-            kind="component",
-            labels=labels,
-            weights={
-                "x": component[1]["x"],
-                "y": component[1]["y"],
-                "z": component[1]["z"],
-                "force_e": component[1]["force_e"],
-                "force_t": component[1]["force_t"],
-                "force_r": component[1]["force_r"],
-                "electro_e": component[1]["electro_e"],
-                "electro_t": component[1]["electro_t"],
-                "electro_r": component[1]["electro_r"],
-                "thermo_e": component[1]["thermo_e"],
-                "thermo_t": component[1]["thermo_t"],
-                "thermo_r": component[1]["thermo_r"],
-            },
-            annotations={
-                "id": component[1]["id"],
-            },
-        )
-        ss.g.add_node(fancy_node)
-
-    for i, row in df_dsm.iterrows():
-        for j, value in enumerate(row):
-            # print(i, j, value)
-            # print()
-            if i == j:
-                continue
-            if value in kinds.keys():
-                kind = kinds[value]
-            else:
-                kind = None
-            ss.g.add_edge(
-                Edge(
-                    source=ss.g.nodes[i],
-                    target=ss.g.nodes[j],
-                    name=f'{ss.g.nodes[i].annotations["id"]}_{ss.g.nodes[j].annotations["id"]}',
-                    kind=kind,
-                    labels=[],
-                    weights={
-                        "distance": df_distances.iloc[i, j],
-                    },
-                    annotations={},
-                )
-            )
 
 if "matrix" not in ss:
     ss.matrix = "Interfaces DSM"
     # on_matrix_selection(ss.matrix)
 
 # Import data from data/Mitigations.csv into dataframe
-df_mitigations = get_data("data/Mitigations.csv").fillna(False)
+df_mitigations = dataset.mitigations
 
 if (
     "mitigations_selected_s1" not in ss
@@ -515,8 +536,7 @@ if "cost_mitigations" not in ss and "reliability_mitigations" not in ss:
 
 # Original systems designs
 if "df_systems" not in ss:
-    # ss.df_systems = pd.read_csv("data/Systems.csv", sep=";", decimal=",")
-    ss.df_systems = get_data("data/Systems.csv")
+    ss.df_systems = dataset.systems_copy()
     calculate_ms()
 
 if "group" not in ss:
@@ -656,6 +676,10 @@ with st.expander("Info", expanded=True):
 # If the user has filled in the intro form correctly
 is_ready = (ss.group != "Select") and ss.consent
 if is_ready:
+    import plotly.express as px
+
+    cm_g2r, cm_r2g = get_colormaps()
+
     # with st.expander("**Select system**", expanded=False):
     with st.sidebar:
         system_logo = st.empty()
@@ -1081,12 +1105,8 @@ if is_ready:
                 """
             )
 
-            if ss.system == "System 1":
-                df_risks_to_display = df_risks[df_risks["s1"] == True]
-            elif ss.system == "System 2":
-                df_risks_to_display = df_risks[df_risks["s2"] == True]
-            elif ss.system == "System 3":
-                df_risks_to_display = df_risks[df_risks["s3"] == True]
+            if ss.system is not None:
+                df_risks_to_display = systems.risk_table(ss.system)
             else:
                 df_risks_to_display = df_risks
 
@@ -1143,27 +1163,53 @@ if is_ready:
                 horizontal=True,
             )
 
-            if ss.matrix == "Interfaces DSM":
-                if ss.system == "System 1":
-                    st.image("assets/s1_interfaces.png")
-                elif ss.system == "System 2":
-                    st.image("assets/s2_interfaces.png")
-                elif ss.system == "System 3":
-                    st.image("assets/s3_interfaces.png")
-            elif ss.matrix == "Distance DSM":
-                if ss.system == "System 1":
-                    st.image("assets/s1_distances.png")
-                elif ss.system == "System 2":
-                    st.image("assets/s2_distances.png")
-                elif ss.system == "System 3":
-                    st.image("assets/s3_distances.png")
-            elif ss.matrix == "Risk DSM":
-                if ss.system == "System 1":
-                    st.image("assets/s1_risk.png")
-                elif ss.system == "System 2":
-                    st.image("assets/s2_risk.png")
-                elif ss.system == "System 3":
-                    st.image("assets/s3_risk.png")
+            ss.matrix_order = st.radio(
+                label="Order of the components",
+                options=list(ORDERS),
+                format_func=ORDERS.get,
+                index=0,
+                captions=[
+                    "Order of the input data",
+                    "Coupled blocks, with no feedback between them",
+                    "Modules that minimize the interactions between them",
+                ],
+                horizontal=True,
+            )
+
+            if ss.system is not None:
+                # Large matrices are zoomed into by their rows and columns,
+                # drawn at the level of detail that fits the window
+                window = None
+                size = zoom_size(data, ss.system, ss.matrix)
+                if size:
+                    window = st.slider(
+                        "Components shown (rows and columns)",
+                        min_value=0,
+                        max_value=size,
+                        value=(0, size),
+                    )
+                try:
+                    figure = matrix_figure(
+                        get_figure_cache(),
+                        data,
+                        ss.system,
+                        ss.matrix,
+                        ss.matrix_order,
+                        window,
+                    )
+                except Exception:
+                    # Fall back to the last rendered image of the matrix
+                    image = image_path(system_key(ss.system), ss.matrix)
+                    if image is None:
+                        raise
+                    logger.exception("Showing the image of the %s", ss.matrix)
+                    st.warning(
+                        "The matrix could not be drawn from the data, "
+                        "here is its last rendered image (in the order of the data)."
+                    )
+                    st.image(image)
+                else:
+                    st.plotly_chart(figure, use_container_width=True)
 
         with st.expander(f"**Select {ss.system} risks for mitigation**", expanded=True):
             st.markdown(
@@ -1177,7 +1223,7 @@ if is_ready:
             if ss.system == "System 1":
                 questions_tab2_col1.multiselect(
                     label="Select the risks you would like to mitigate.",
-                    options=df_risks[df_risks["s1"] == True].ID,
+                    options=systems.risk_table("s1").ID,
                     help="Select the risks you would like to mitigate.",
                     key="risks_selected_s1",
                     on_change=on_risks_selection(ss.risks_selected_s1),
@@ -1206,7 +1252,7 @@ if is_ready:
             elif ss.system == "System 2":
                 questions_tab2_col1.multiselect(
                     label="Select the risks you would like to mitigate.",
-                    options=df_risks[df_risks["s2"] == True].ID,
+                    options=systems.risk_table("s2").ID,
                     help="Select the risks you would like to mitigate.",
                     key="risks_selected_s2",
                     on_change=on_risks_selection(ss.risks_selected_s2),
@@ -1235,7 +1281,7 @@ if is_ready:
             elif ss.system == "System 3":
                 questions_tab2_col1.multiselect(
                     label="Select the risks you would like to mitigate.",
-                    options=df_risks[df_risks["s3"] == True].ID,
+                    options=systems.risk_table("s3").ID,
                     help="Select the risks you would like to mitigate.",
                     key="risks_selected_s3",
                     on_change=on_risks_selection(ss.risks_selected_s3),
@@ -1348,7 +1394,7 @@ if is_ready:
 
             questions_tab3_s1_col1.multiselect(
                 label="Select the mitigations you would like to mitigate.",
-                options=df_mitigations[df_mitigations["s1"] == True].ID,
+                options=systems.mitigation_table("s1").ID,
                 help="Select the mitigations you would like to mitigate.",
                 key="mitigations_selected_s1",
                 on_change=on_mitigations_selection(ss.mitigations_selected_s1),
@@ -1420,7 +1466,7 @@ if is_ready:
 
             questions_tab3_s2_col1.multiselect(
                 label="Select the mitigations you would like to mitigate.",
-                options=df_mitigations[df_mitigations["s2"] == True].ID,
+                options=systems.mitigation_table("s2").ID,
                 help="Select the mitigations you would like to mitigate.",
                 key="mitigations_selected_s2",
                 on_change=on_risks_selection(ss.mitigations_selected_s2),
@@ -1492,7 +1538,7 @@ if is_ready:
 
             questions_tab3_s3_col1.multiselect(
                 label="Select the mitigations you would like to mitigate.",
-                options=df_mitigations[df_mitigations["s3"] == True].ID,
+                options=systems.mitigation_table("s3").ID,
                 help="Select the mitigations you would like to mitigate.",
                 key="mitigations_selected_s3",
                 on_change=on_risks_selection(ss.mitigations_selected_s3),
@@ -1881,58 +1927,31 @@ if is_ready:
 
 print(f"Session ID: {get_session_id()}")
 
+# Only the fields that changed since the last upload are persisted, as
+# events of the session log
+if "session_log" not in ss:
+    ss.session_log = SessionLog(get_session_id())
+
+# Whether any of the forms was submitted in this rerun
+submitted = is_ready and (form_tab1_submitted or form_tab3_submitted or submit_button)
+
 try:
-    document_name = f"{get_session_id()}_{get_timestamp()}"
-    session_state_ref = db.collection("session_states").document(document_name)
-    # And then uploading the data to that reference
-    session_state_ref.set(
-        {
-            "session_id": get_session_id(),
-            "timestamp": get_timestamp(),
-            "role": ss.role,
-            "sector": ss.sector,
-            "experience": ss.experience,
-            "group": ss.group,
-            "risks_selected_s1": ss.risks_selected_s1,
-            "risks_selected_s2": ss.risks_selected_s2,
-            "risks_selected_s3": ss.risks_selected_s3,
-            "mitigations_selected_s1": ss.mitigations_selected_s1,
-            "mitigations_selected_s2": ss.mitigations_selected_s2,
-            "mitigations_selected_s3": ss.mitigations_selected_s3,
-            "matrix": ss.matrix,
-            "q1": ss.q1,
-            "q2": ss.q2,
-            "q3": ss.q3,
-            "q4": ss.q4,
-            "q5": ss.q5,
-            "q6": ss.q6,
-            "q7": ss.q7,
-            "q8": ss.q8,
-            "before": {
-                "artic_s1": ss.before_artic_s1,
-                "artic_s2": ss.before_artic_s2,
-                "artic_s3": ss.before_artic_s3,
-                "desert_s1": ss.before_desert_s1,
-                "desert_s2": ss.before_desert_s2,
-                "desert_s3": ss.before_desert_s3,
-                "special_s1": ss.before_special_s1,
-                "special_s2": ss.before_special_s2,
-                "special_s3": ss.before_special_s3,
-            },
-            "after": {
-                "artic_s1": ss.after_artic_s1,
-                "artic_s2": ss.after_artic_s2,
-                "artic_s3": ss.after_artic_s3,
-                "desert_s1": ss.after_desert_s1,
-                "desert_s2": ss.after_desert_s2,
-                "desert_s3": ss.after_desert_s3,
-                "special_s1": ss.after_special_s1,
-                "special_s2": ss.after_special_s2,
-                "special_s3": ss.after_special_s3,
-            },
-        }
-    )
-    st.toast("Session state data uploaded to database", icon="📡")
+    writes = []
+    if upload_policy.should_upload(ss.consent, ss.group, submitted):
+        writes = ss.session_log.record(get_session_snapshot(), get_timestamp())
+    if writes:
+        # The queue uploads the writes in the background
+        if upload_queue.enqueue(writes):
+            ss.session_log.commit()
+            st.toast("Session state data queued for upload to database", icon="📡")
+        else:
+            st.toast("Session state data not queued: upload queue is full", icon="📡")
 except Exception as e:
     st.toast(f"Session state data not uploaded to database: {e}", icon="📡")
     pass
+
+# Counters and batch commit latencies of the upload queue, for the organizers
+# (open the app with ?debug in the URL); they are also logged periodically
+if "debug" in st.query_params:
+    with st.sidebar.expander("Upload queue", expanded=True):
+        st.json(upload_queue.metrics())
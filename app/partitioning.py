@@ -0,0 +1,174 @@
+"""
+Partitioning (sequencing) of a DSM:
+    1. strongly connected components with an iterative Tarjan's algorithm
+    2. ordering the components in blocks so that the marks between blocks
+       are all below the diagonal (no feedback between blocks)
+    3. the permutation to reorder any view of the components (interfaces,
+       distances, risks), shared with the clusterings of clustering.py
+
+A mark (i, j) means that component i depends on component j (row i takes an
+input from column j). In the partitioned order j comes before i whenever
+they are in different blocks; the feedback marks left are within the
+blocks, which are the coupled sets of components (the cycles of the DSM).
+
+Tarjan's algorithm runs in O(components + marks) and finds the blocks in
+reverse topological order of the dependencies, which is the order of the
+partitioned DSM.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import scipy.sparse as sp
+
+from dsm import DSM
+
+
+def strong_components(matrix: sp.csr_matrix) -> tuple[np.ndarray, int]:
+    """Return the block of every component and the number of blocks.
+
+    The blocks are numbered in the order Tarjan's algorithm completes them:
+    a block comes after all the blocks it depends on.
+    """
+    size = matrix.shape[0]
+    indptr = matrix.indptr.tolist()
+    indices = matrix.indices.tolist()
+    index = [-1] * size
+    low = [0] * size
+    on_stack = [False] * size
+    labels = [-1] * size
+    stack = []
+    counter = 0
+    count = 0
+
+    for root in range(size):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        # Depth-first search without recursion: (component, next mark)
+        work = [(root, indptr[root])]
+        while work:
+            v, position = work[-1]
+            end = indptr[v + 1]
+            while position < end:
+                w = indices[position]
+                position += 1
+                if index[w] == -1:
+                    work[-1] = (v, position)
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, indptr[w]))
+                    break
+                if on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        labels[w] = count
+                        if w == v:
+                            break
+                    count += 1
+    return np.array(labels, dtype=np.intp), count
+
+
+class Ordering:
+    """An order of the components of a DSM, grouped in numbered blocks."""
+
+    def __init__(self, labels: np.ndarray, order: np.ndarray):
+        """Initialize the ordering from the block of every component.
+
+        The order lists the components of block 0 first, then of block 1...
+        """
+        self.labels = np.asarray(labels)
+        self.count = int(self.labels.max()) + 1 if len(self.labels) else 0
+        self.size = len(self.labels)
+        self.order = np.asarray(order)
+        self.positions = np.empty(self.size, dtype=np.intp)
+        self.positions[self.order] = np.arange(self.size)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """Number of components of each block, in block order."""
+        return np.bincount(self.labels, minlength=self.count)
+
+    def blocks(self) -> list[np.ndarray]:
+        """Return the components of each block, in order."""
+        bounds = np.cumsum(self.sizes)[:-1]
+        return np.split(self.order, bounds)
+
+    def apply(self, matrix: np.ndarray) -> np.ndarray:
+        """Return a components x components matrix in this order."""
+        return np.asarray(matrix)[np.ix_(self.order, self.order)]
+
+    def apply_dsm(self, dsm: DSM) -> DSM:
+        """Return a DSM with its components in this order."""
+        return dsm.submatrix(self.order)
+
+    def reorder(self, names: list, labels: list) -> np.ndarray:
+        """Return the permutation of labels that follows this order.
+
+        The labels are names of the components in another order (e.g. the
+        rows of a risk matrix); the labels not in names go last.
+        """
+        rank = {name: position for position, name in enumerate(self.ordered(names))}
+        keys = [rank.get(label, len(rank)) for label in labels]
+        return np.argsort(keys, kind="stable")
+
+    def ordered(self, names: list) -> list:
+        """Return the names of the components in this order."""
+        return [names[i] for i in self.order]
+
+
+class Partition(Ordering):
+    """The partitioned order of the components of a DSM."""
+
+    def __init__(self, matrix: sp.csr_matrix):
+        """Initialize the partition of a DSM given as a sparse matrix of marks."""
+        # The diagonal is not a dependency
+        coo = sp.coo_matrix(matrix)
+        keep = (coo.row != coo.col) & (coo.data != 0)
+        rows, cols = coo.row[keep], coo.col[keep]
+        size = coo.shape[0]
+        marks = sp.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)), shape=coo.shape
+        )
+        labels, _ = strong_components(marks)
+
+        # Within a block, the components that depend on more of the block
+        # than the block depends on them go last (fewer feedback marks)
+        inside = labels[rows] == labels[cols]
+        balance = np.bincount(rows[inside], minlength=size) - np.bincount(
+            cols[inside], minlength=size
+        )
+        super().__init__(labels, np.lexsort((np.arange(size), balance, labels)))
+        self._marks = (rows, cols)
+
+    def __repr__(self):
+        """Return a string representation of the partition."""
+        coupled = int((self.sizes > 1).sum())
+        return (
+            f"Partition({self.size} components, {self.count} blocks, "
+            f"{coupled} coupled, {self.feedback()} feedback marks)"
+        )
+
+    @classmethod
+    def from_dsm(cls, dsm: DSM, kinds=None) -> Partition:
+        """Return the partition of the interfaces of a DSM (all kinds by default)."""
+        return cls(dsm.layer(kinds))
+
+    def feedback(self) -> int:
+        """Return the number of marks above the diagonal in the partitioned order."""
+        rows, cols = self._marks
+        return int((self.positions[cols] > self.positions[rows]).sum())
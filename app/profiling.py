@@ -0,0 +1,112 @@
+"""
+Import-time profiling of the app:
+    1. finding the modules that app/main.py imports at the top level
+    2. importing them in a fresh interpreter with `python -X importtime`
+    3. reporting the cumulative cost of each import and the slowest modules
+    4. reporting the cost of the modules that main.py defers
+
+Usage:
+    python app/profiling.py
+    python app/profiling.py --module plotly.express --top 30
+
+Every measurement runs in a new process, so the modules are not cached by
+earlier imports (except those imported by the interpreter itself).
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imported by main.py only when a feature needs them
+DEFERRED = [
+    "plotly.express",
+    "seaborn",
+    "google.cloud.firestore",
+]
+
+
+def startup_imports(script: str = os.path.join(APP_DIR, "main.py")) -> list[str]:
+    """Return the modules imported at the top level of a script."""
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            if node.module != "__future__":
+                modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def _importtime(code: str) -> list[tuple[str, int, int, int]]:
+    """Return the `python -X importtime` entries of running some code."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def import_times(modules: list[str]) -> list[tuple[str, int, int, int]]:
+    """Return (module, self, cumulative, depth) of every module imported.
+
+    Times are in microseconds. The modules imported by the interpreter
+    startup (site, encodings, ...) are left out.
+    """
+    startup = {name for name, _, _, _ in _importtime("pass")}
+    code = "\n".join(f"import {module}" for module in modules)
+    return [entry for entry in _importtime(code) if entry[0] not in startup]
+
+
+def report(modules: list[str], top: int = 15) -> str:
+    """Return a text report of the import cost of some modules."""
+    times = import_times(modules)
+    roots = {name: cumulative for name, _, cumulative, depth in times if depth == 0}
+    lines = [f"{'cumulative [ms]':>16}  top-level import"]
+    for name, cumulative in sorted(roots.items(), key=lambda item: -item[1]):
+        lines.append(f"{cumulative / 1000:16.1f}  {name}")
+    lines.append(f"{sum(roots.values()) / 1000:16.1f}  total")
+    lines.append("")
+    lines.append(f"{'self [ms]':>16}  slowest modules")
+    for name, self_us, _, _ in sorted(times, key=lambda item: -item[1])[:top]:
+        lines.append(f"{self_us / 1000:16.1f}  {name}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the import time of the app.")
+    parser.add_argument("--script", default=os.path.join(APP_DIR, "main.py"))
+    parser.add_argument("--module", action="append", help="modules to profile")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    if args.module:
+        print(report(args.module, args.top))
+    else:
+        print("Startup imports of", args.script)
+        print(report(startup_imports(args.script), args.top))
+        for module in DEFERRED:
+            print()
+            print("Deferred:", module)
+            try:
+                print(report([module], 0).split("\n\n")[0])
+            except RuntimeError as error:
+                print(f"  not available ({error})")
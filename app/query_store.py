@@ -0,0 +1,243 @@
+"""
+Indexed local query store for the collected data:
+    1. loading the export incrementally (only new part files)
+    2. looking up and deleting the data of a session
+    3. counting rows and sessions per group in a time window
+
+Usage:
+    python app/query_store.py --export collected_data/export --db collected_data/sessions.sqlite3
+    python app/query_store.py --session <session_id>
+    python app/query_store.py --delete <session_id> --backend firestore --key firestore-key.json
+    python app/query_store.py --start "2023-10-04 10:15:00" --end "2023-10-04 11:15:00"
+
+Every exported document (legacy session_states snapshots and the event
+documents of the reruns) is one row, indexed on (session_id, timestamp),
+(group, timestamp) and timestamp. Rows that do not carry the group (deltas
+and most reruns) get the last group of their session, so group aggregations
+need no scan of the data.
+
+Deleting a session deletes it from the storage backend and from the export
+too (see export.delete_session), so rebuilding the store does not bring it
+back.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+
+import pyarrow.parquet as pq
+
+from export import read_tombstones
+
+COLLECTIONS = ("session_states", "events")
+
+
+def document_group(collection: str, data: dict) -> str | None:
+    """Return the group set by a document, or None if it does not set one."""
+    if collection == "events":
+        group = None
+        for event in data["events"]:
+            if event["type"] == "start":
+                group = event["value"].get("group", group)
+            elif event["type"] == "set" and event["field"] == "group":
+                group = event["value"]
+        return group
+    return data.get("group")
+
+
+class QueryStore:
+    """A SQLite store of the collected documents."""
+
+    def __init__(self, path: str = "collected_data/sessions.sqlite3"):
+        """Open (or create) the store."""
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                document TEXT NOT NULL,
+                session_id TEXT,
+                timestamp TEXT,
+                "group" TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, document)
+            );
+            CREATE INDEX IF NOT EXISTS documents_session
+                ON documents (session_id, timestamp);
+            CREATE INDEX IF NOT EXISTS documents_group
+                ON documents ("group", timestamp);
+            CREATE INDEX IF NOT EXISTS documents_timestamp
+                ON documents (timestamp);
+            CREATE TABLE IF NOT EXISTS loaded_parts (
+                path TEXT PRIMARY KEY
+            );
+            """
+        )
+
+    def __repr__(self):
+        """Return a string representation of the store."""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return f"QueryStore({self.path}, {count} documents)"
+
+    def _last_group(self, session_id: str, timestamp: str) -> str | None:
+        """Return the last known group of a session before a timestamp."""
+        row = self._conn.execute(
+            'SELECT "group" FROM documents WHERE session_id = ? AND timestamp <= ? '
+            'AND "group" IS NOT NULL ORDER BY timestamp DESC LIMIT 1',
+            (session_id, timestamp),
+        ).fetchone()
+        return row[0] if row else None
+
+    def load_export(self, export_dir: str, collections=COLLECTIONS) -> int:
+        """Load the part files of the export that were not loaded yet.
+
+        The documents of the sessions deleted from the export are skipped.
+        """
+        deleted = read_tombstones(export_dir)
+        loaded = 0
+        for collection in collections:
+            directory = os.path.join(export_dir, collection)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not name.endswith(".parquet") or self._conn.execute(
+                    "SELECT 1 FROM loaded_parts WHERE path = ?", (path,)
+                ).fetchone():
+                    continue
+                loaded += self._load_part(collection, path, deleted)
+        return loaded
+
+    def _load_part(self, collection: str, path: str, deleted: set = frozenset()) -> int:
+        """Load one part file of the export in a single transaction."""
+        table = pq.read_table(path).to_pydict()
+        rows = sorted(
+            (
+                row
+                for row in zip(
+                    table["timestamp"],
+                    table["document"],
+                    table["session_id"],
+                    table["data"],
+                )
+                if row[2] not in deleted
+            ),
+            key=lambda row: (row[0] or ""),
+        )
+        groups = {}
+        self._conn.execute("BEGIN")
+        for timestamp, document, session_id, data in rows:
+            group = document_group(collection, json.loads(data))
+            if group is None:
+                if session_id not in groups:
+                    groups[session_id] = self._last_group(session_id, timestamp)
+                group = groups[session_id]
+            groups[session_id] = group
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents "
+                '(collection, document, session_id, timestamp, "group", data) '
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (collection, document, session_id, timestamp, group, data),
+            )
+        self._conn.execute("INSERT INTO loaded_parts (path) VALUES (?)", (path,))
+        self._conn.execute("COMMIT")
+        return len(rows)
+
+    def session(self, session_id: str) -> list[dict]:
+        """Return the documents of a session sorted by timestamp."""
+        rows = self._conn.execute(
+            "SELECT collection, document, data FROM documents WHERE session_id = ? "
+            "ORDER BY timestamp, document",
+            (session_id,),
+        ).fetchall()
+        return [
+            {"collection": collection, "document": document, **json.loads(data)}
+            for collection, document, data in rows
+        ]
+
+    def delete_session(
+        self, session_id: str, export_dir: str | None = None, storage=None
+    ) -> int:
+        """Delete the documents of a session. Returns the number of documents.
+
+        With an export folder, the session is purged from the export, and with
+        a storage backend from the backend (see events.delete_session), before
+        it is deleted from the store.
+        """
+        if export_dir is not None:
+            from export import delete_session
+
+            delete_session(export_dir, session_id)
+        if storage is not None:
+            import events
+
+            events.delete_session(storage, session_id)
+        cursor = self._conn.execute(
+            "DELETE FROM documents WHERE session_id = ?", (session_id,)
+        )
+        return cursor.rowcount
+
+    def count_by_group(
+        self,
+        start: str | None = None,
+        end: str | None = None,
+        collection: str | None = None,
+    ) -> dict:
+        """Return {group: (rows, sessions)} for the documents in [start, end)."""
+        query = 'SELECT "group", COUNT(*), COUNT(DISTINCT session_id) FROM documents'
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        if collection is not None:
+            conditions.append("collection = ?")
+            params.append(collection)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self._conn.execute(query + ' GROUP BY "group"', params).fetchall()
+        return {group: (count, sessions) for group, count, sessions in rows}
+
+    def close(self):
+        """Close the store."""
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the collected data.")
+    parser.add_argument("--export", default="collected_data/export", help="export folder")
+    parser.add_argument("--db", default="collected_data/sessions.sqlite3", help="store file")
+    parser.add_argument("--session", help="print the documents of a session")
+    parser.add_argument("--delete", help="delete the documents of a session")
+    parser.add_argument("--backend", default="firestore", help="storage backend")
+    parser.add_argument("--key", default="firestore-key.json", help="service account key")
+    parser.add_argument("--path", default="storage.sqlite3", help="SQLite storage file")
+    parser.add_argument("--start", help="start of the time window")
+    parser.add_argument("--end", help="end of the time window")
+    args = parser.parse_args()
+
+    store = QueryStore(args.db)
+    print(f"Loaded {store.load_export(args.export)} new documents into {store}")
+    if args.session:
+        for document in store.session(args.session):
+            print(document)
+    elif args.delete:
+        from storage import open_storage
+
+        storage = open_storage(
+            {"backend": args.backend, "key_file": args.key, "path": args.path}
+        )
+        count = store.delete_session(args.delete, args.export, storage)
+        print(f"Deleted {count} documents")
+    else:
+        for group, (count, sessions) in sorted(
+            store.count_by_group(args.start, args.end).items(), key=str
+        ):
+            print(f"Group {group}: {count} rows, {sessions} sessions")
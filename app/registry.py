@@ -0,0 +1,371 @@
+"""
+Hot-reloading registry of the input data:
+    1. tracking the mtime and content hash of every input file
+    2. declaring the values derived from the files and from each other
+    3. rebuilding only the values that depend on a changed file
+    4. rebuilding in the background and swapping the new version in at once
+    5. watching the data folder from a daemon thread
+    6. lazy values, built on first use and shared by all sessions
+    7. warming the new version up before the swap
+
+Sessions read the values of the current version with snapshot(). A rebuild
+works on a copy of the values and replaces them with a single assignment, so
+the reruns in progress keep the version they started with. Before the swap,
+the rebuilt lazy values that were in use are built, and the reload hooks
+(e.g. building the cached figures) run on the new version, so the first rerun
+after a reload does not build them. If a rebuild fails (e.g. a CSV file is
+saved half-way), the old version stays in place and the rebuild is retried on
+the next check.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from bundle import read_bundle, source_hash
+from dataset import (
+    RISK_LABELS,
+    SOURCES,
+    TABLES,
+    Dataset,
+    component_positions,
+    read_risk_labels,
+    read_source,
+)
+from geometry import Geometry
+from schema import SCHEMAS
+from systems import SystemIndex
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: str) -> str:
+    """Return the content hash of a file."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Lazy:
+    """A value that is built on first use, once for all the sessions."""
+
+    def __init__(self, build: Callable, values: dict):
+        """Initialize the value with its build function and its version."""
+        self._build = build
+        self._values = values
+        self._lock = threading.Lock()
+        self._built = False
+        self._value = None
+
+    def __repr__(self):
+        """Return a string representation of the value."""
+        return f"Lazy(built={self._built})"
+
+    @property
+    def built(self) -> bool:
+        """Whether the value was built."""
+        return self._built
+
+    def get(self) -> Any:
+        """Return the value, building it on first use."""
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self._build(self._values)
+                    self._built = True
+        return self._value
+
+
+class Snapshot(dict):
+    """The values of one version, building the lazy ones when accessed."""
+
+    hashes = {}
+
+    def __getitem__(self, name: str) -> Any:
+        """Return a value, building it if it is lazy."""
+        value = super().__getitem__(name)
+        return value.get() if isinstance(value, Lazy) else value
+
+    def hash(self, names) -> str:
+        """Return the combined content hash of some files of this version."""
+        digest = hashlib.sha256()
+        for name in sorted(names):
+            digest.update(f"{name}={self.hashes[name]};".encode())
+        return digest.hexdigest()
+
+
+class Registry:
+    """Versioned values built from input files and from each other."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self.version = 0
+        self.errors = {}
+        self._nodes = {}
+        self._paths = {}
+        self._files = {}
+        self._values = Snapshot()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._hooks = []
+
+    def __repr__(self):
+        """Return a string representation of the registry."""
+        return (
+            f"Registry(version={self.version}, {len(self._paths)} files, "
+            f"{len(self._nodes) - len(self._paths)} derived values)"
+        )
+
+    def add_file(
+        self, name: str, path: str, read: Callable, depends=(), lazy: bool = False
+    ):
+        """Declare a value read from a file, e.g. read(values) -> DataFrame."""
+        self._paths[name] = path
+        self.add(name, read, depends, lazy)
+
+    def add(self, name: str, build: Callable, depends=(), lazy: bool = False):
+        """Declare a value built from other values: build(values) -> value.
+
+        Lazy values are built on first access instead of on (re)load, e.g.
+        to import the modules they need only when a session uses them.
+        """
+        self._nodes[name] = (build, tuple(depends), lazy)
+
+    def on_reload(self, hook: Callable):
+        """Call hook(values) with the values of each reloaded version.
+
+        The hooks run in the watcher thread before the new version is swapped
+        in. If one fails, the old version stays in place.
+        """
+        self._hooks.append(hook)
+
+    def get(self, name: str) -> Any:
+        """Return a value of the current version."""
+        return self._values[name]
+
+    def snapshot(self) -> dict:
+        """Return all the values of the current version.
+
+        A rerun should take one snapshot, so that all its values are of the
+        same version even if a reload is swapped in meanwhile.
+        """
+        return self._values
+
+    def _order(self, names: set) -> list[str]:
+        """Return the names and all their dependents, dependencies first."""
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dependency in self._nodes[name][1]:
+                visit(dependency)
+            order.append(name)
+
+        for name in self._nodes:
+            visit(name)
+        stale = set(names)
+        for name in order:
+            if any(dependency in stale for dependency in self._nodes[name][1]):
+                stale.add(name)
+        return [name for name in order if name in stale]
+
+    def _build(self, names: set, values: dict) -> dict:
+        """Return a copy of the values with the names (and dependents) rebuilt."""
+        values = Snapshot(values)
+        for name in self._order(names):
+            build, _, lazy = self._nodes[name]
+            values[name] = Lazy(build, values) if lazy else build(values)
+        return values
+
+    def _warm(self, values: Snapshot):
+        """Build the rebuilt lazy values that are in use and run the hooks."""
+        for name, value in dict.items(values):
+            old = dict.get(self._values, name)
+            if value is not old and isinstance(old, Lazy) and old.built:
+                value.get()
+        for hook in self._hooks:
+            hook(values)
+
+    def stat_files(self) -> dict:
+        """Return {name: (mtime, hash)} of all the files."""
+        return {
+            name: (os.path.getmtime(path), file_hash(path))
+            for name, path in self._paths.items()
+        }
+
+    def load(self, initial: dict | None = None, files: dict | None = None):
+        """Build all the values, taking the given ones as they are.
+
+        The files can be given as returned by stat_files(), if they were
+        just hashed.
+        """
+        with self._lock:
+            files = files or self.stat_files()
+            values = dict(initial or {})
+            missing = {name for name in self._nodes if name not in values}
+            values = self._build(missing, values)
+            values.hashes = {name: digest for name, (_, digest) in files.items()}
+            self._values = values
+            self._files = files
+            self.version += 1
+
+    def changed_files(self) -> dict:
+        """Return {name: (mtime, hash)} of the files whose content changed.
+
+        Only the files with a new mtime are hashed.
+        """
+        changed = {}
+        for name, path in self._paths.items():
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if mtime == self._files[name][0]:
+                continue
+            digest = file_hash(path)
+            if digest == self._files[name][1]:
+                # Touched but unchanged: no rebuild
+                self._files[name] = (mtime, digest)
+                continue
+            changed[name] = (mtime, digest)
+        return changed
+
+    def refresh(self) -> list[str]:
+        """Rebuild the values that depend on changed files and swap them in.
+
+        Returns the names of the changed files (empty if nothing changed or
+        a rebuild is already running).
+        """
+        if not self._lock.acquire(blocking=False):
+            return []
+        try:
+            changed = self.changed_files()
+            if not changed:
+                return []
+            try:
+                values = self._build(set(changed), self._values)
+                values.hashes = {
+                    **self._values.hashes,
+                    **{name: digest for name, (_, digest) in changed.items()},
+                }
+                self._warm(values)
+            except Exception as error:
+                logger.warning("Keeping data version %s: %s", self.version, error)
+                self.errors = {name: error for name in changed}
+                return []
+            self._values = values
+            self._files.update(changed)
+            self.errors = {}
+            self.version += 1
+            logger.info("Reloaded %s (version %s)", sorted(changed), self.version)
+            return sorted(changed)
+        finally:
+            self._lock.release()
+
+    def watch(self, interval: float = 2.0):
+        """Check the files for changes every interval seconds, in the background."""
+        if self._watcher is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Data reload failed")
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(
+            target=run, name="data-registry", daemon=True
+        )
+        self._watcher.start()
+
+
+def data_registry(
+    data_dir: str = "data", bundle_dir: str = "data/bundle"
+) -> Registry:
+    """Return the registry of the input files and the values derived from them.
+
+    The first version is read from the bundle when it is up to date.
+    """
+    registry = Registry()
+
+    def reader(name):
+        def read(values):
+            if name in SCHEMAS and name != "components":
+                ids = values["components"]["id"].to_numpy()
+                return read_source(data_dir, name, ids)
+            return read_source(data_dir, name)
+
+        return read
+
+    for name, file in SOURCES.items():
+        linked = name in SCHEMAS and name != "components"
+        depends = ["components"] if linked else []
+        registry.add_file(name, os.path.join(data_dir, file), reader(name), depends)
+
+    # Component names of the risk matrices, only in the Excel exports
+    for name, file in RISK_LABELS.items():
+        path = os.path.join(data_dir, file)
+        registry.add_file(
+            name, path, lambda values, path=path: read_risk_labels(path), lazy=True
+        )
+
+    def dataset(values):
+        tables = {name: values[name] for name in TABLES}
+        arrays = {name: values[name] for name in SOURCES if name not in TABLES}
+        return Dataset(tables, arrays, data_dir)
+
+    registry.add("dataset", dataset, SOURCES)
+
+    # The values below depend on the files they read, not on the dataset, so
+    # an edit of e.g. Mitigations.csv does not rebuild the geometry
+
+    # Sparse DSM, shared by all sessions (scipy is imported on first use)
+    def interfaces(values):
+        from dsm import DSM
+
+        return DSM.from_kinds(values["dsm"], values["components"]["name"])
+
+    registry.add("interfaces", interfaces, ["dsm", "components"], lazy=True)
+
+    # Distances and spatial index of the component positions (scipy is
+    # imported on first query)
+    registry.add(
+        "geometry",
+        lambda values: Geometry(component_positions(values["components"])),
+        ["components"],
+    )
+
+    # Positions and tables of the components, risks and mitigations of each
+    # system, so switching systems is a lookup
+    def system_index(values):
+        return SystemIndex(
+            values["components"],
+            values["tech_risks"],
+            values["mitigations"],
+            {"dsm": values["dsm"]},
+        )
+
+    registry.add(
+        "system_index",
+        system_index,
+        ["components", "tech_risks", "mitigations", "dsm"],
+    )
+
+    # The files are hashed once, for the bundle and the reload checks
+    files = registry.stat_files()
+    hashes = {file: files[name][1] for name, file in SOURCES.items()}
+    bundle = read_bundle(bundle_dir, source_hash(data_dir, hashes))
+    initial = None
+    if bundle is not None:
+        tables, arrays = bundle
+        initial = {**tables, **arrays}
+    registry.load(initial, files)
+    return registry
@@ -0,0 +1,235 @@
+"""
+Build-time renderer of the matrix images of the systems:
+    1. rendering every system x matrix figure of figures.py in a process pool
+    2. skipping the images whose inputs (data files, the code of the modules
+       the figures are built with, plotly and kaleido versions, sizes) have
+       not changed since the last build
+    3. writing optimized PNG and WebP files at the displayed size, and WebP
+       files at twice that size for high-density screens
+
+Usage:
+    python app/render_matrices.py --data data --out assets
+    python app/render_matrices.py --force --workers 4
+
+The images are rendered with kaleido (pip install kaleido, which needs
+Chrome: plotly_get_chrome). The content hash of the inputs of each image is
+kept in a manifest next to the images, so a build with no changes only
+hashes the input files.
+
+The app draws the matrices from the data; the images (in the order of the
+data) are its static fallback when a figure cannot be built, e.g. while a
+data file is being edited (see image_path).
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib import metadata
+
+from dataset import RISK_LABELS, SOURCES, SYSTEMS
+from registry import file_hash
+
+MANIFEST = "matrices.json"
+# File name of each matrix, as the images of assets/ (s1_interfaces.png, ...)
+MATRICES = {
+    "Interfaces DSM": "interfaces",
+    "Distance DSM": "distances",
+    "Risk DSM": "risk",
+}
+# Width of the row labels, next to the cells of figures.CELL_SIZE pixels
+LABEL_WIDTH = 320
+# Scales of the WebP files (1 is also written as PNG)
+SCALES = {"": 1, "@2x": 2}
+# Lossless WebP is much smaller than lossy for the flat colors of the matrices
+WEBP_OPTIONS = {"lossless": True, "quality": 100, "method": 4}
+# Modules the figures are built with: the data loading, the matrices and
+# their orders, the figures and this renderer
+MODULES = [
+    "bundle.py",
+    "clustering.py",
+    "dataset.py",
+    "dsm.py",
+    "figures.py",
+    "geometry.py",
+    "heatmap.py",
+    "partitioning.py",
+    "registry.py",
+    "render_matrices.py",
+    "schema.py",
+    "systems.py",
+]
+# Packages the images are drawn with
+PACKAGES = ["plotly", "kaleido", "pillow"]
+
+_data = None
+
+
+def image_name(system: str, matrix: str) -> str:
+    """Return the file name (without extension) of a matrix image."""
+    return f"{system}_{MATRICES[matrix]}"
+
+
+def image_path(system: str, matrix: str, out_dir: str = "assets") -> str | None:
+    """Return the PNG file of a matrix of a system, or None if not rendered."""
+    path = os.path.join(out_dir, f"{image_name(system, matrix)}.png")
+    return path if os.path.exists(path) else None
+
+
+def package_version(package: str) -> str:
+    """Return the installed version of a package, or "" if not installed."""
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def input_hash(data_dir: str, system: str, matrix: str) -> str:
+    """Return the content hash of everything an image is rendered from."""
+    from figures import MATRIX_FIGURES
+
+    files = {**SOURCES, **RISK_LABELS}
+    digest = hashlib.sha256(f"{LABEL_WIDTH};{SCALES};{WEBP_OPTIONS}".encode())
+    for package in PACKAGES:
+        digest.update(f"{package}={package_version(package)};".encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in MODULES:
+        digest.update(file_hash(os.path.join(here, module)).encode())
+    for name in sorted(MATRIX_FIGURES[matrix][1](system)):
+        path = os.path.join(data_dir, files[name])
+        digest.update(f"{name}={file_hash(path)};".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(out_dir: str) -> dict:
+    """Return the {image name: input hash} of the last build."""
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(out_dir: str, manifest: dict):
+    """Write the manifest atomically."""
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def output_files(name: str) -> list[str]:
+    """Return the files written for an image."""
+    return [f"{name}.png"] + [f"{name}{suffix}.webp" for suffix in SCALES]
+
+
+def stale_images(data_dir: str, out_dir: str, force: bool = False) -> dict:
+    """Return {(system, matrix): input hash} of the images to render."""
+    manifest = read_manifest(out_dir)
+    stale = {}
+    for system in SYSTEMS:
+        for matrix in MATRICES:
+            name = image_name(system, matrix)
+            digest = input_hash(data_dir, system, matrix)
+            missing = any(
+                not os.path.exists(os.path.join(out_dir, file))
+                for file in output_files(name)
+            )
+            if force or missing or manifest.get(name) != digest:
+                stale[(system, matrix)] = digest
+    return stale
+
+
+def _init_worker(data_dir: str, bundle_dir: str):
+    """Load the data once per worker process."""
+    global _data
+    from registry import data_registry
+
+    _data = data_registry(data_dir, bundle_dir).snapshot()
+
+
+def write_variants(png: bytes, name: str, out_dir: str, width: int, height: int):
+    """Write the PNG and WebP files of an image rendered at the largest scale."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(png)).convert("RGB")
+    for suffix, scale in SCALES.items():
+        size = (width * scale, height * scale)
+        resized = image if image.size == size else image.resize(size, Image.LANCZOS)
+        # A palette of 256 colors is lossless enough for the flat colors and
+        # makes both formats much smaller
+        resized = resized.quantize(256)
+        path = os.path.join(out_dir, f"{name}{suffix}")
+        resized.save(f"{path}.webp", format="WEBP", **WEBP_OPTIONS)
+        if scale == 1:
+            resized.save(f"{path}.png", format="PNG", optimize=True)
+
+
+def render(system: str, matrix: str, out_dir: str) -> tuple[str, float]:
+    """Render the files of an image; return its name and the render time."""
+    from figures import CELL_SIZE, MATRIX_FIGURES
+
+    start = time.perf_counter()
+    figure = MATRIX_FIGURES[matrix][0](_data, system)
+    width = CELL_SIZE * len(figure.data[0].z) + LABEL_WIDTH
+    height = figure.layout.height
+    # One render at the largest scale, resized for the others
+    scale = max(SCALES.values())
+    png = figure.to_image(format="png", width=width, height=height, scale=scale)
+    name = image_name(system, matrix)
+    write_variants(png, name, out_dir, width, height)
+    return name, time.perf_counter() - start
+
+
+def render_all(
+    data_dir: str = "data",
+    out_dir: str = "assets",
+    bundle_dir: str = "data/bundle",
+    workers: int | None = None,
+    force: bool = False,
+) -> list[str]:
+    """Render the stale images in a process pool; return their names."""
+    stale = stale_images(data_dir, out_dir, force)
+    if not stale:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_manifest(out_dir)
+    workers = min(len(stale), workers or os.cpu_count() or 1)
+    rendered = []
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(data_dir, bundle_dir)
+    ) as pool:
+        futures = {
+            pool.submit(render, system, matrix, out_dir): (system, matrix)
+            for system, matrix in stale
+        }
+        for future in as_completed(futures):
+            name, elapsed = future.result()
+            print(f"Rendered {name} in {elapsed:.2f} s")
+            manifest[name] = stale[futures[future]]
+            write_manifest(out_dir, manifest)
+            rendered.append(name)
+    return rendered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the matrix images.")
+    parser.add_argument("--data", default="data", help="folder of the input data")
+    parser.add_argument("--bundle", default="data/bundle", help="data bundle")
+    parser.add_argument("--out", default="assets", help="output folder")
+    parser.add_argument("--workers", type=int, help="processes (default: CPUs)")
+    parser.add_argument("--force", action="store_true", help="render all images")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rendered = render_all(args.data, args.out, args.bundle, args.workers, args.force)
+    elapsed = time.perf_counter() - start
+    if rendered:
+        print(f"Rendered {len(rendered)} images in {elapsed:.2f} s")
+    else:
+        print(f"All images are up to date ({elapsed:.3f} s)")
@@ -0,0 +1,226 @@
+"""
+Typed schemas of the input tables:
+    1. declaring the dtype of every column of each CSV table
+    2. validating the mitigation A/B columns and parsing them into flat
+       integer arrays
+    3. validating the tables when they are loaded
+    4. reporting the memory of the tables before and after typing
+
+Usage:
+    python app/schema.py --data data
+
+Column types:
+    bool: True/False, empty cells are False
+    int16 / float32: compact numbers, empty cells are not allowed
+    float64 / int64: numbers that are summed into displayed costs and
+        profits, kept at full precision
+    category: repeated strings
+    str: unique strings
+    links: lists of component ids such as "[1,22]", or "All" for all
+        components, kept as category strings; parse_links() returns them as
+        one flat int16 array with the offset of each row (see Links)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+FLOAT32_RISKS = {
+    f"{domain}_{measure}": "float32"
+    for domain in ["force", "electro", "thermo"]
+    for measure in ["e", "r"]
+}
+SYSTEM_FLAGS = {"s1": "bool", "s2": "bool", "s3": "bool"}
+
+SCHEMAS = {
+    "components": {
+        "name": "str",
+        "id": "int16",
+        "x": "int16",
+        "y": "int16",
+        "z": "int16",
+        **FLOAT32_RISKS,
+        "force_t": "int16",
+        "electro_t": "int16",
+        "thermo_t": "int16",
+        **SYSTEM_FLAGS,
+    },
+    "tech_risks": {
+        "ID": "str",
+        "Name": "str",
+        "Mechanical": "float32",
+        "Electromagnetic": "float32",
+        "Thermal": "float32",
+        "Comments": "category",
+        **SYSTEM_FLAGS,
+    },
+    "mitigations": {
+        "ID": "str",
+        "Risk Mitigation element": "category",
+        "Affects the interactions between": "str",
+        "A": "links",
+        "B": "links",
+        "Cost (k€)": "float64",
+        "id2": "int16",
+        "x": "int16",
+        "y": "int16",
+        "z": "int16",
+        "force_e2": "float32",
+        "force_t": "int16",
+        "force_r": "float32",
+        "electro_e2": "float32",
+        "electro_t": "int16",
+        "electro_r": "float32",
+        "thermo_e2": "float32",
+        "thermo_t": "int16",
+        "Reliability gain": "float64",
+        "Mechanical": "bool",
+        "Electromagnetic": "bool",
+        "Thermal": "bool",
+        **SYSTEM_FLAGS,
+    },
+    "systems": {
+        "id": "int16",
+        "name": "str",
+        "description": "str",
+        "min_R": "float64",
+        "reliability": "float64",
+        "price": "int64",
+        "cost": "int64",
+    },
+}
+
+
+class Links:
+    """The component ids of the rows of a links column, in CSR layout.
+
+    The ids of row i are ids[offsets[i]:offsets[i + 1]], so the column takes
+    one int16 per id instead of one array object per row.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray):
+        """Initialize the links from the flat ids and the row offsets."""
+        self.ids = ids
+        self.offsets = offsets
+
+    def __repr__(self):
+        """Return a string representation of the links."""
+        return f"Links({len(self)} rows, {len(self.ids)} ids, {self.nbytes} bytes)"
+
+    def __len__(self):
+        """Return the number of rows."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        """Return the component ids of a row (a view of the flat array)."""
+        return self.ids[self.offsets[row] : self.offsets[row + 1]]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the ids and offsets, in bytes."""
+        return self.ids.nbytes + self.offsets.nbytes
+
+
+def parse_link(value, ids: np.ndarray) -> list[int]:
+    """Return the component ids of a cell such as "[1,22]" or "All"."""
+    if isinstance(value, str) and value.strip() == "All":
+        return ids.tolist()
+    return json.loads(value)
+
+
+def parse_links(values: pd.Series, ids: np.ndarray) -> Links:
+    """Return the component ids of the cells of a links column."""
+    rows = [parse_link(value, ids) for value in values]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    flat = np.array([i for row in rows for i in row], dtype=np.int16)
+    return Links(flat, offsets)
+
+
+def apply_schema(
+    name: str, df: pd.DataFrame, component_ids: np.ndarray | None = None
+) -> pd.DataFrame:
+    """Return the table with the dtypes of its schema.
+
+    Raises ValueError if the table does not match the schema. Columns that
+    are not in the schema are kept as they are.
+    """
+    schema = SCHEMAS[name]
+    missing = [column for column in schema if column not in df]
+    if missing:
+        raise ValueError(f"{name}: missing columns {missing}")
+    df = df.copy()
+    for column, dtype in schema.items():
+        values = df[column]
+        if dtype == "bool":
+            invalid = ~values.isna() & ~values.isin([True, False])
+            if invalid.any():
+                raise ValueError(
+                    f"{name}.{column}: not a boolean {values[invalid].tolist()}"
+                )
+            df[column] = values.fillna(False).astype(bool)
+            continue
+        if values.isna().any():
+            rows = values[values.isna()].index.tolist()
+            raise ValueError(f"{name}.{column}: empty cells in rows {rows}")
+        if dtype == "links":
+            try:
+                links = parse_links(values, component_ids)
+            except (TypeError, ValueError) as error:
+                raise ValueError(f"{name}.{column}: invalid links ({error})")
+            unknown = np.setdiff1d(links.ids, component_ids)
+            if len(unknown):
+                raise ValueError(
+                    f"{name}.{column}: unknown components {unknown.tolist()}"
+                )
+            df[column] = values.astype("category")
+        elif dtype in ("int16", "int64"):
+            if not pd.api.types.is_integer_dtype(values):
+                raise ValueError(f"{name}.{column}: not an integer column")
+            info = np.iinfo(dtype)
+            if values.min() < info.min or values.max() > info.max:
+                raise ValueError(f"{name}.{column}: values out of the {dtype} range")
+            df[column] = values.astype(dtype)
+        elif dtype in ("float32", "float64"):
+            if not pd.api.types.is_numeric_dtype(values):
+                raise ValueError(f"{name}.{column}: not a numeric column")
+            df[column] = values.astype(dtype)
+        else:
+            df[column] = values.astype(dtype)
+    return df
+
+
+def memory_report(raw: dict, typed: dict) -> pd.DataFrame:
+    """Return the memory (bytes) of each table before and after typing."""
+    rows = [
+        {
+            "table": name,
+            "before": raw[name].memory_usage(deep=True).sum(),
+            "after": typed[name].memory_usage(deep=True).sum(),
+        }
+        for name in typed
+    ]
+    report = pd.DataFrame(rows).set_index("table")
+    report.loc["total"] = report.sum()
+    report["ratio"] = (report["after"] / report["before"]).round(2)
+    return report
+
+
+if __name__ == "__main__":
+    from dataset import TABLES, read_csv, type_tables
+
+    parser = argparse.ArgumentParser(description="Validate the input tables.")
+    parser.add_argument("--data", default="data", help="folder of the CSV files")
+    args = parser.parse_args()
+
+    raw = {
+        name: read_csv(f"{args.data}/{file}")
+        for name, file in TABLES.items()
+        if name in SCHEMAS
+    }
+    typed = type_tables(raw)
+    print(memory_report(raw, {name: typed[name] for name in raw}))
@@ -0,0 +1,75 @@
+"""
+Session state snapshots:
+    1. computing the delta between a snapshot and the last persisted one
+    2. applying deltas to rebuild the full snapshots
+"""
+
+import copy
+
+# Marker for fields that were never persisted
+MISSING = object()
+
+
+def apply_delta(state: dict, delta: dict) -> dict:
+    """Apply a delta to a snapshot in place and return it."""
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(state.get(key), dict):
+            state[key].update(copy.deepcopy(value))
+        else:
+            state[key] = copy.deepcopy(value)
+    return state
+
+
+def expand_deltas(documents: list[dict], key: str = "session_id") -> list[dict]:
+    """Rebuild full snapshots from delta documents sorted by timestamp."""
+    states = {}
+    expanded = []
+    for document in documents:
+        state = states.setdefault(document[key], {})
+        expanded.append(copy.deepcopy(apply_delta(state, document)))
+    return expanded
+
+
+class SnapshotDiffer:
+    """Remembers the last persisted snapshot of a session."""
+
+    def __init__(self):
+        """Initialize the differ without a persisted snapshot."""
+        self.last = None
+        self.written = 0
+        self.skipped = 0
+
+    def __repr__(self):
+        """Return a string representation of the differ."""
+        return f"SnapshotDiffer(written={self.written}, skipped={self.skipped})"
+
+    def diff(self, snapshot: dict) -> dict:
+        """Return the fields of the snapshot that changed since the last commit.
+
+        Nested dicts (e.g. the before/after ratings) are compared per key, so
+        only the changed ratings are included. An empty dict means that there
+        is nothing to persist.
+        """
+        if self.last is None:
+            return copy.deepcopy(snapshot)
+        delta = {}
+        for key, value in snapshot.items():
+            old = self.last.get(key, MISSING)
+            if isinstance(value, dict) and isinstance(old, dict):
+                changed = {
+                    k: v for k, v in value.items() if old.get(k, MISSING) != v
+                }
+                if changed:
+                    delta[key] = copy.deepcopy(changed)
+            elif old != value:
+                delta[key] = copy.deepcopy(value)
+        if not delta:
+            self.skipped += 1
+        return delta
+
+    def commit(self, delta: dict):
+        """Record a delta as persisted."""
+        if self.last is None:
+            self.last = {}
+        apply_delta(self.last, delta)
+        self.written += 1
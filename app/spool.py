@@ -0,0 +1,153 @@
+"""
+Local durable spool for the documents uploaded to the storage backend:
+    1. appending documents to an SQLite file in WAL mode
+    2. replaying the pending documents to the storage backend in batches
+    3. bulk uploading a spool from the command line
+
+Usage:
+    python app/spool.py --spool spool.sqlite3 --backend firestore --key firestore-key.json
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+
+from storage import merge_document
+
+# Firestore does not accept more than 500 writes in a single batch
+MAX_BATCH_SIZE = 500
+
+
+class Spool:
+    """A spool of the pending (collection, document, data) writes of each document."""
+
+    def __init__(self, path: str = "spool.sqlite3"):
+        """Open (or create) the spool file."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                document TEXT NOT NULL,
+                data TEXT NOT NULL,
+                synced INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (collection, document)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS spool_pending ON spool (synced, seq)"
+        )
+
+    def __repr__(self):
+        """Return a string representation of the spool."""
+        return f"Spool({self.path}, {self.counts()})"
+
+    def append(self, writes: list[tuple[str, str, dict]]):
+        """Append writes to the spool in a single transaction.
+
+        Writing the same document again replaces its row with a new seq and
+        the new data, pending: a replay that read the old row before the
+        rewrite only marks the old seq as synced. As the backends merge the
+        writes into the documents, a write is merged into the pending write
+        of its document, if any. The document IDs make the replay idempotent.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for collection, document, data in writes:
+                row = self._conn.execute(
+                    "SELECT data FROM spool "
+                    "WHERE collection = ? AND document = ? AND synced = 0",
+                    (collection, document),
+                ).fetchone()
+                if row:
+                    data = merge_document(json.loads(row[0]), data)
+                self._conn.execute(
+                    "REPLACE INTO spool (collection, document, data) VALUES (?, ?, ?)",
+                    (collection, document, json.dumps(data, default=str)),
+                )
+            self._conn.execute("COMMIT")
+
+    def pending(self, limit: int = MAX_BATCH_SIZE) -> list[tuple[int, str, str, dict]]:
+        """Return the oldest pending writes as (seq, collection, document, data)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, collection, document, data FROM spool "
+                "WHERE synced = 0 ORDER BY seq LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(seq, c, d, json.loads(data)) for seq, c, d, data in rows]
+
+    def mark_synced(self, seqs: list[int]):
+        """Mark writes as uploaded to the storage backend."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE spool SET synced = 1 WHERE seq = ?", [(seq,) for seq in seqs]
+            )
+
+    def compact(self) -> int:
+        """Delete the synced writes and return their number.
+
+        A synced document that is written again is appended anew, so only
+        the pending writes need to be kept.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM spool WHERE synced = 1").rowcount
+
+    def counts(self) -> dict:
+        """Return the number of pending and synced writes."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT synced, COUNT(*) FROM spool GROUP BY synced"
+            ).fetchall()
+        counts = dict(rows)
+        return {"pending": counts.get(0, 0), "synced": counts.get(1, 0)}
+
+    def close(self):
+        """Close the spool file."""
+        with self._lock:
+            self._conn.close()
+
+
+def replay(spool: Spool, commit, batch_size: int = MAX_BATCH_SIZE) -> int:
+    """Upload the pending writes with commit(writes) until none are left.
+
+    Returns the number of uploaded writes. Exceptions raised by commit are
+    propagated, and the writes of the failed batch stay pending. The synced
+    writes are deleted from the spool once all are uploaded.
+    """
+    uploaded = 0
+    while True:
+        rows = spool.pending(min(batch_size, MAX_BATCH_SIZE))
+        if not rows:
+            if uploaded:
+                spool.compact()
+            return uploaded
+        commit([(collection, document, data) for _, collection, document, data in rows])
+        spool.mark_synced([seq for seq, *_ in rows])
+        uploaded += len(rows)
+
+
+if __name__ == "__main__":
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="Upload a spool to the database.")
+    parser.add_argument("--spool", default="spool.sqlite3", help="spool file")
+    parser.add_argument("--backend", default="firestore", help="storage backend")
+    parser.add_argument("--key", default="firestore-key.json", help="service account key")
+    parser.add_argument("--path", default="storage.sqlite3", help="SQLite storage file")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    storage = open_storage(
+        {"backend": args.backend, "key_file": args.key, "path": args.path}
+    )
+    spool = Spool(args.spool)
+    print(f"Uploaded {replay(spool, storage.commit, args.batch_size)} documents")
+    print(spool)
@@ -0,0 +1,445 @@
+"""
+Storage backends for the collected data:
+    1. Firestore (the hosted database used during the workshops)
+    2. in-memory (for load tests and development)
+    3. SQLite (for offline workshops and local benchmarks)
+    4. selecting the backend from the app configuration
+"""
+
+from __future__ import annotations
+
+import copy
+import datetime
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+PROJECT = "dsm2023isw"
+
+# Sorts after any document ID that starts with a given prefix
+PREFIX_END = "\uf8ff"
+# Field set by the backend to the UTC time of the commit of each document:
+# unlike the timestamp of the rerun, it orders the documents that reach the
+# backend late (spool replays, retried batches) after the earlier commits
+COMMITTED = "committed_at"
+COMMITTED_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def commit_time() -> str:
+    """Return the current UTC time in the format of the commit times."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime(COMMITTED_FORMAT)
+
+
+def merge_document(data: dict, update: dict) -> dict:
+    """Merge the fields of a write into a document in place and return it.
+
+    Nested dicts are merged key by key, other values are replaced (like a
+    Firestore set with merge=True).
+    """
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            merge_document(data[key], value)
+        else:
+            data[key] = value
+    return data
+
+
+class Storage(ABC):
+    """Interface of a document storage backend.
+
+    Documents are dicts identified by a collection and a document ID. All
+    writes go through commit(), which stores a list of
+    (collection, document, data) writes atomically and sets the COMMITTED
+    field of the documents to the commit time. The data of a write is merged
+    into the existing document (see merge_document), so a write only needs
+    the fields that changed.
+    """
+
+    name = "storage"
+
+    def __repr__(self):
+        """Return a string representation of the backend."""
+        return f"{type(self).__name__}()"
+
+    @abstractmethod
+    def commit(self, writes: list[tuple[str, str, dict]]):
+        """Store a batch of documents, merged into the existing ones."""
+
+    @abstractmethod
+    def get(self, collection: str, document: str) -> dict | None:
+        """Return a document, or None if it does not exist."""
+
+    @abstractmethod
+    def stream(
+        self, collection: str, prefix: str | None = None
+    ) -> Iterator[tuple[str, dict]]:
+        """Iterate over the (document, data) pairs of a collection.
+
+        With a prefix, only the documents whose ID starts with it are read
+        (a range scan over the document IDs).
+        """
+
+    @abstractmethod
+    def query(
+        self,
+        collection: str,
+        field: str,
+        start=None,
+        after: tuple | None = None,
+        end=None,
+        limit: int = 500,
+    ) -> list[tuple[str, dict]]:
+        """Return a page of documents ordered by (field, document ID).
+
+        Only documents with start <= field < end are returned, strictly after
+        the (value, document) cursor. Documents without the field are skipped.
+        """
+
+    @abstractmethod
+    def delete(self, collection: str, documents: list[str]):
+        """Delete documents from a collection."""
+
+
+class FirestoreStorage(Storage):
+    """Storage backed by a Google Cloud Firestore client."""
+
+    name = "firestore"
+
+    def __init__(self, db=None, connect=None):
+        """Initialize the backend with a firestore.Client.
+
+        Instead of a client, a connect function can be given: it is called
+        on first use, so google.cloud is only imported when the backend is
+        actually used (e.g. by the upload thread, not at app start).
+        """
+        self._db = db
+        self._connect = connect
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a string representation of the backend."""
+        if self._db is None:
+            return "FirestoreStorage(not connected)"
+        return f"FirestoreStorage({self._db.project})"
+
+    @property
+    def db(self):
+        """The firestore.Client, created on first use."""
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._connect()
+        return self._db
+
+    @classmethod
+    def from_key(cls, key_dict: dict, project: str = PROJECT) -> FirestoreStorage:
+        """Create a backend that authenticates with a service account key."""
+
+        def connect():
+            from google.cloud import firestore
+            from google.oauth2 import service_account
+
+            creds = service_account.Credentials.from_service_account_info(key_dict)
+            return firestore.Client(credentials=creds, project=project)
+
+        return cls(connect=connect)
+
+    def commit(self, writes: list[tuple[str, str, dict]]):
+        """Store a batch of documents with a single WriteBatch.
+
+        The commit time is the server timestamp of the batch.
+        """
+        from google.cloud.firestore import SERVER_TIMESTAMP
+
+        batch = self.db.batch()
+        for collection, document, data in writes:
+            batch.set(
+                self.db.collection(collection).document(document),
+                {**data, COMMITTED: SERVER_TIMESTAMP},
+                merge=True,
+            )
+        batch.commit()
+
+    @staticmethod
+    def _decode(data: dict | None) -> dict | None:
+        """Return a document with its commit time as a string, like the others."""
+        if data is not None and isinstance(data.get(COMMITTED), datetime.datetime):
+            committed = data[COMMITTED].astimezone(datetime.timezone.utc)
+            data[COMMITTED] = committed.strftime(COMMITTED_FORMAT)
+        return data
+
+    @staticmethod
+    def _encode(field: str, value):
+        """Return a query value of a field, as stored by Firestore."""
+        if field != COMMITTED or value is None:
+            return value
+        committed = datetime.datetime.strptime(value, COMMITTED_FORMAT)
+        return committed.replace(tzinfo=datetime.timezone.utc)
+
+    def get(self, collection: str, document: str) -> dict | None:
+        """Return a document, or None if it does not exist."""
+        snapshot = self.db.collection(collection).document(document).get()
+        return self._decode(snapshot.to_dict())
+
+    def stream(
+        self, collection: str, prefix: str | None = None
+    ) -> Iterator[tuple[str, dict]]:
+        """Iterate over the (document, data) pairs of a collection."""
+        from google.cloud.firestore import FieldFilter
+
+        query = self.db.collection(collection)
+        if prefix is not None:
+            start = query.document(prefix)
+            end = query.document(prefix + PREFIX_END)
+            query = query.where(filter=FieldFilter("__name__", ">=", start)).where(
+                filter=FieldFilter("__name__", "<", end)
+            )
+        for snapshot in query.stream():
+            yield snapshot.id, self._decode(snapshot.to_dict())
+
+    def query(
+        self,
+        collection: str,
+        field: str,
+        start=None,
+        after: tuple | None = None,
+        end=None,
+        limit: int = 500,
+    ) -> list[tuple[str, dict]]:
+        """Return a page of documents ordered by (field, document ID)."""
+        from google.cloud.firestore import FieldFilter
+
+        query = self.db.collection(collection)
+        if start is not None:
+            start = self._encode(field, start)
+            query = query.where(filter=FieldFilter(field, ">=", start))
+        if end is not None:
+            end = self._encode(field, end)
+            query = query.where(filter=FieldFilter(field, "<", end))
+        query = query.order_by(field).order_by("__name__")
+        if after is not None:
+            value = self._encode(field, after[0])
+            query = query.start_after({field: value, "__name__": after[1]})
+        snapshots = query.limit(limit).stream()
+        return [(s.id, self._decode(s.to_dict())) for s in snapshots]
+
+    def delete(self, collection: str, documents: list[str]):
+        """Delete documents from a collection."""
+        batch = self.db.batch()
+        for document in documents:
+            batch.delete(self.db.collection(collection).document(document))
+        batch.commit()
+
+
+class MemoryStorage(Storage):
+    """Storage that keeps the documents in a dict for the process lifetime."""
+
+    name = "memory"
+
+    def __init__(self):
+        """Initialize an empty backend."""
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a string representation of the backend."""
+        sizes = {name: len(docs) for name, docs in self.collections.items()}
+        return f"MemoryStorage({sizes})"
+
+    def commit(self, writes: list[tuple[str, str, dict]]):
+        """Store a batch of documents (copied through JSON, like a database)."""
+        encoded = [(c, d, json.loads(json.dumps(data))) for c, d, data in writes]
+        with self._lock:
+            committed = commit_time()
+            for collection, document, data in encoded:
+                data[COMMITTED] = committed
+                docs = self.collections.setdefault(collection, {})
+                old = copy.deepcopy(docs.get(document, {}))
+                docs[document] = merge_document(old, data)
+
+    def get(self, collection: str, document: str) -> dict | None:
+        """Return a document, or None if it does not exist."""
+        with self._lock:
+            return self.collections.get(collection, {}).get(document)
+
+    def stream(
+        self, collection: str, prefix: str | None = None
+    ) -> Iterator[tuple[str, dict]]:
+        """Iterate over the (document, data) pairs of a collection."""
+        with self._lock:
+            items = sorted(self.collections.get(collection, {}).items())
+        for document, data in items:
+            if prefix is None or document.startswith(prefix):
+                yield document, data
+
+    def query(
+        self,
+        collection: str,
+        field: str,
+        start=None,
+        after: tuple | None = None,
+        end=None,
+        limit: int = 500,
+    ) -> list[tuple[str, dict]]:
+        """Return a page of documents ordered by (field, document ID)."""
+        with self._lock:
+            items = [
+                (data[field], document, data)
+                for document, data in self.collections.get(collection, {}).items()
+                if data.get(field) is not None
+                and (start is None or data[field] >= start)
+                and (end is None or data[field] < end)
+                and (after is None or (data[field], document) > tuple(after))
+            ]
+        items.sort(key=lambda item: item[:2])
+        return [(document, data) for _, document, data in items[:limit]]
+
+    def delete(self, collection: str, documents: list[str]):
+        """Delete documents from a collection."""
+        with self._lock:
+            docs = self.collections.get(collection, {})
+            for document in documents:
+                docs.pop(document, None)
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite file (WAL mode)."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "storage.sqlite3"):
+        """Open (or create) the database file."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                document TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, document)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def __repr__(self):
+        """Return a string representation of the backend."""
+        return f"SQLiteStorage({self.path})"
+
+    def commit(self, writes: list[tuple[str, str, dict]]):
+        """Store a batch of documents in a single transaction."""
+        with self._lock:
+            # The commit time is taken in the write transaction, so the
+            # commits of other processes are ordered by it too
+            self._conn.execute("BEGIN IMMEDIATE")
+            committed = commit_time()
+            merged = {}
+            for collection, document, data in writes:
+                key = (collection, document)
+                if key not in merged:
+                    row = self._conn.execute(
+                        "SELECT data FROM documents "
+                        "WHERE collection = ? AND document = ?",
+                        key,
+                    ).fetchone()
+                    merged[key] = json.loads(row[0]) if row else {}
+                merge_document(merged[key], {**data, COMMITTED: committed})
+            rows = [
+                (c, d, json.dumps(data, default=str))
+                for (c, d), data in merged.items()
+            ]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (collection, document, data) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+
+    def get(self, collection: str, document: str) -> dict | None:
+        """Return a document, or None if it does not exist."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND document = ?",
+                (collection, document),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def stream(
+        self, collection: str, prefix: str | None = None
+    ) -> Iterator[tuple[str, dict]]:
+        """Iterate over the (document, data) pairs of a collection."""
+        query = "SELECT document, data FROM documents WHERE collection = ?"
+        params = [collection]
+        if prefix is not None:
+            query += " AND document >= ? AND document < ?"
+            params += [prefix, prefix + PREFIX_END]
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY document", params).fetchall()
+        for document, data in rows:
+            yield document, json.loads(data)
+
+    def query(
+        self,
+        collection: str,
+        field: str,
+        start=None,
+        after: tuple | None = None,
+        end=None,
+        limit: int = 500,
+    ) -> list[tuple[str, dict]]:
+        """Return a page of documents ordered by (field, document ID)."""
+        query = (
+            "SELECT document, data, json_extract(data, ?) AS key FROM documents "
+            "WHERE collection = ? AND key IS NOT NULL"
+        )
+        params = [f'$."{field}"', collection]
+        if start is not None:
+            query += " AND key >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND key < ?"
+            params.append(end)
+        if after is not None:
+            query += " AND (key > ? OR (key = ? AND document > ?))"
+            params += [after[0], after[0], after[1]]
+        query += " ORDER BY key, document LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(document, json.loads(data)) for document, data, _ in rows]
+
+    def delete(self, collection: str, documents: list[str]):
+        """Delete documents from a collection."""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM documents WHERE collection = ? AND document = ?",
+                [(collection, document) for document in documents],
+            )
+
+
+def open_storage(config: dict) -> Storage:
+    """Create the storage backend selected by a config dict.
+
+    The "backend" key selects "firestore" (default), "memory" or "sqlite".
+    Firestore needs a service account "key" (dict or JSON string) or a
+    "key_file"; SQLite uses "path".
+    """
+    backend = config.get("backend", "firestore")
+    if backend == "firestore":
+        key = config.get("key")
+        if key is None:
+            with open(config.get("key_file", "firestore-key.json")) as f:
+                key = json.load(f)
+        elif isinstance(key, str):
+            key = json.loads(key)
+        return FirestoreStorage.from_key(key, config.get("project", PROJECT))
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(config.get("path", "storage.sqlite3"))
+    raise ValueError(f"Unknown storage backend {backend!r}")
@@ -0,0 +1,175 @@
+"""
+Per-system index of the input data:
+    1. the row positions of the components, risks and mitigations of each system
+    2. per-system tables and matrices, built once per data version
+    3. deriving the per-system CSV files (s1_dsm.csv, ...) from the master files
+
+Usage:
+    python app/systems.py --data data --out data/derived
+    python app/systems.py --data data --check
+
+The index arrays are read-only positions into the master tables and
+matrices of the Dataset, so the per-system data never has to be kept in sync
+by hand: a system is the set of components flagged in Components.csv.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import SYSTEMS, Dataset, read_only
+from geometry import Geometry
+
+SYSTEM_NAMES = {
+    "s1": "System 1",
+    "s2": "System 2",
+    "s3": "System 3",
+}
+SYSTEM_KEYS = {name: system for system, name in SYSTEM_NAMES.items()}
+
+
+def system_key(system: str) -> str:
+    """Return the key ("s1") of a system given by key or name ("System 1")."""
+    return SYSTEM_KEYS.get(system, system)
+
+
+class SystemIndex:
+    """The positions of the data of each system in the master tables."""
+
+    def __init__(
+        self,
+        components: pd.DataFrame,
+        risks: pd.DataFrame,
+        mitigations: pd.DataFrame,
+        matrices: dict,
+    ):
+        """Initialize the index of the master tables and component matrices."""
+        self.matrices = matrices
+        self.components = {}
+        self.risks = {}
+        self.mitigations = {}
+        self._tables = {}
+        for system in SYSTEMS:
+            self.components[system] = self._positions(components[system])
+            self.risks[system] = self._positions(risks[system])
+            self.mitigations[system] = self._positions(mitigations[system])
+            self._tables[system] = {
+                "components": components.iloc[self.components[system]],
+                "risks": risks.iloc[self.risks[system]],
+                "mitigations": mitigations.iloc[self.mitigations[system]],
+            }
+        self._matrices = {}
+
+    def __repr__(self):
+        """Return a string representation of the index."""
+        sizes = ", ".join(
+            f"{system}={len(positions)}"
+            for system, positions in self.components.items()
+        )
+        return f"SystemIndex({sizes})"
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset) -> SystemIndex:
+        """Return the index of a dataset."""
+        return cls(
+            dataset.components, dataset.tech_risks, dataset.mitigations, dataset.arrays
+        )
+
+    @staticmethod
+    def _positions(flags: pd.Series) -> np.ndarray:
+        """Return the read-only row positions of the True flags."""
+        return read_only(np.flatnonzero(flags.to_numpy(dtype=bool)))
+
+    def component_table(self, system: str) -> pd.DataFrame:
+        """Return the components of a system."""
+        return self._tables[system_key(system)]["components"]
+
+    def risk_table(self, system: str) -> pd.DataFrame:
+        """Return the technical risks of a system."""
+        return self._tables[system_key(system)]["risks"]
+
+    def mitigation_table(self, system: str) -> pd.DataFrame:
+        """Return the mitigations available for a system."""
+        return self._tables[system_key(system)]["mitigations"]
+
+    def matrix(self, name: str, system: str) -> np.ndarray:
+        """Return a component matrix (e.g. "dsm") for a system."""
+        key = (name, system_key(system))
+        if key not in self._matrices:
+            positions = self.components[key[1]]
+            matrix = self.matrices[name][np.ix_(positions, positions)]
+            self._matrices[key] = read_only(matrix)
+        return self._matrices[key]
+
+    def distances(self, geometry, system: str) -> np.ndarray:
+        """Return the float32 distance matrix of the components of a system."""
+        return geometry.submatrix(self.components[system_key(system)])
+
+    def interfaces(self, dsm, system: str):
+        """Return the sparse DSM of the interfaces within a system."""
+        return dsm.submatrix(self.components[system_key(system)])
+
+
+def format_matrix(matrix: np.ndarray) -> str:
+    """Return a matrix in the format of the data folder.
+
+    Semicolon-separated, with decimal commas, and empty cells for zeros and
+    for the diagonal.
+    """
+    lines = []
+    for i, row in enumerate(matrix):
+        cells = []
+        for j, value in enumerate(row):
+            if i == j or value in ("", 0):
+                cells.append("")
+            elif isinstance(value, str):
+                cells.append(value)
+            else:
+                cells.append(f"{value:.10g}".replace(".", ","))
+        lines.append(";".join(cells))
+    return "\n".join(lines) + "\n"
+
+
+def derive_files(index: SystemIndex, geometry: Geometry) -> dict:
+    """Return {file name: content} of the per-system DSM and distance files.
+
+    The distances are written at full precision, from the positions.
+    """
+    files = {}
+    for system in SYSTEMS:
+        positions = index.components[system]
+        files[f"{system}_dsm.csv"] = format_matrix(index.matrix("dsm", system))
+        files[f"{system}_distances.csv"] = format_matrix(
+            geometry.distance(*np.ix_(positions, positions))
+        )
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive the per-system files.")
+    parser.add_argument("--data", default="data", help="folder of the master files")
+    parser.add_argument("--out", default="data/derived", help="output folder")
+    parser.add_argument(
+        "--check", action="store_true", help="compare with the files in --data"
+    )
+    args = parser.parse_args()
+
+    dataset = Dataset.from_csv(args.data)
+    index = SystemIndex.from_dataset(dataset)
+    print(index)
+    for name, content in derive_files(index, Geometry(dataset.positions)).items():
+        if args.check:
+            with open(os.path.join(args.data, name), encoding="utf-8-sig") as f:
+                current = f.read().replace("\r\n", "\n").rstrip("\n") + "\n"
+            status = "up to date" if current == content else "differs"
+            rows = current.count("\n"), content.count("\n")
+            print(f"{name}: {status} ({rows[0]} rows on disk, {rows[1]} derived)")
+        else:
+            os.makedirs(args.out, exist_ok=True)
+            with open(os.path.join(args.out, name), "w", encoding="utf-8-sig") as f:
+                f.write(content)
+            print(f"Wrote {os.path.join(args.out, name)}")
@@ -0,0 +1,86 @@
+"""
+Upload policy for the session state data:
+    1. reading the policy from the app configuration
+    2. deciding whether a rerun is worth persisting
+"""
+
+from __future__ import annotations
+
+import datetime
+
+# Upload on every rerun, or only when one of the forms is submitted
+MODES = ("always", "on_submit")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_timestamp(value) -> datetime.datetime | None:
+    """Parse a timestamp string (or pass through a datetime)."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.strptime(str(value), TIMESTAMP_FORMAT)
+
+
+class UploadPolicy:
+    """A class to decide which reruns are persisted to the database."""
+
+    def __init__(
+        self,
+        require_consent: bool = True,
+        require_group: bool = True,
+        window_start: datetime.datetime | None = None,
+        window_end: datetime.datetime | None = None,
+        mode: str = "always",
+    ):
+        """Initialize the policy."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown upload mode {mode!r}, expected one of {MODES}")
+        self.require_consent = require_consent
+        self.require_group = require_group
+        self.window_start = parse_timestamp(window_start)
+        self.window_end = parse_timestamp(window_end)
+        self.mode = mode
+
+    def __repr__(self):
+        """Return a string representation of the policy."""
+        return (
+            f"UploadPolicy(consent={self.require_consent}, group={self.require_group}, "
+            f"window=({self.window_start}, {self.window_end}), mode={self.mode})"
+        )
+
+    @classmethod
+    def from_config(cls, config: dict) -> UploadPolicy:
+        """Create a policy from a config dict (e.g. the [upload_policy] secrets)."""
+        return cls(
+            require_consent=config.get("require_consent", True),
+            require_group=config.get("require_group", True),
+            window_start=config.get("window_start"),
+            window_end=config.get("window_end"),
+            mode=config.get("mode", "always"),
+        )
+
+    def skip_reason(
+        self,
+        consent: bool | None,
+        group: str | None,
+        submitted: bool = False,
+        now: datetime.datetime | None = None,
+    ) -> str | None:
+        """Return why a rerun should not be persisted, or None to persist it."""
+        if self.require_consent and not consent:
+            return "no consent"
+        if self.require_group and group in (None, "Select"):
+            return "no group"
+        if self.window_start is not None or self.window_end is not None:
+            now = now or datetime.datetime.now()
+            if self.window_start is not None and now < self.window_start:
+                return "before the workshop window"
+            if self.window_end is not None and now > self.window_end:
+                return "after the workshop window"
+        if self.mode == "on_submit" and not submitted:
+            return "no form submitted"
+        return None
+
+    def should_upload(self, *args, **kwargs) -> bool:
+        """Return True if the rerun should be persisted."""
+        return self.skip_reason(*args, **kwargs) is None
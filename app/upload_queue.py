@@ -0,0 +1,205 @@
+"""
+Write-behind queue for the session state uploads:
+    1. enqueueing documents from the script thread without blocking
+    2. draining the queue on a background thread
+    3. spooling the documents locally before uploading them
+    4. committing the documents in batches to the storage backend
+    5. flushing the pending documents on shutdown
+    6. logging the counters and batch commit latencies periodically
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from spool import MAX_BATCH_SIZE, Spool, replay
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """A bounded queue that uploads documents to a storage backend in the background.
+
+    With a spool, every batch is first appended to the spool and then the
+    pending writes of the spool are replayed to the backend. If the backend
+    is unreachable the writes stay in the spool and are retried later.
+    Without a backend (storage=None) the documents are only spooled, e.g. to
+    upload them in bulk after an offline workshop.
+    """
+
+    def __init__(
+        self,
+        storage: Storage | None,
+        spool: Spool | None = None,
+        max_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        retry_interval: float = 30.0,
+        metrics_size: int = 1000,
+        metrics_interval: float = 60.0,
+    ):
+        """Initialize the queue and start the background thread.
+
+        The metrics are logged every metrics_interval seconds in which
+        documents were committed, and on close.
+        """
+        self.storage = storage
+        self.spool = spool
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.metrics_interval = metrics_interval
+        self.latencies = deque(maxlen=metrics_size)
+        self.committed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._retry_at = 0.0
+        self._logged_at = time.monotonic()
+        self._logged_committed = 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind-queue", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        """Return a string representation of the queue."""
+        return (
+            f"WriteBehindQueue(pending={self.pending}, "
+            f"committed={self.committed}, dropped={self.dropped}, failed={self.failed})"
+        )
+
+    @property
+    def pending(self) -> int:
+        """Number of enqueued write lists waiting to be committed."""
+        return self._queue.qsize()
+
+    def enqueue(self, writes: list[tuple[str, str, dict]]) -> bool:
+        """Add a list of (collection, document, data) writes to the queue.
+
+        The writes of one call are committed together. Returns False if they
+        had to be dropped.
+        """
+        if self._closed.is_set():
+            self.dropped += len(writes)
+            return False
+        try:
+            self._queue.put_nowait(writes)
+        except queue.Full:
+            self.dropped += len(writes)
+            return False
+        return True
+
+    def metrics(self) -> dict:
+        """Return counters and batch commit latencies (in seconds)."""
+        latencies = sorted(latency for latency, _ in self.latencies)
+        n = len(latencies)
+        metrics = {
+            "pending": self.pending,
+            "committed": self.committed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": n,
+            "latency_mean": sum(latencies) / n if n else None,
+            "latency_p50": latencies[n // 2] if n else None,
+            "latency_p95": latencies[min(n - 1, int(n * 0.95))] if n else None,
+            "latency_max": latencies[-1] if n else None,
+        }
+        if self.spool is not None:
+            metrics["spooled"] = self.spool.counts()["pending"]
+        return metrics
+
+    def log_metrics(self):
+        """Log the metrics (see metrics()) at the INFO level."""
+        metrics = self.metrics()
+        latencies = ", ".join(
+            f"{key[8:]}={metrics[key] * 1000:.1f} ms"
+            for key in ["latency_mean", "latency_p50", "latency_p95", "latency_max"]
+            if metrics[key] is not None
+        )
+        counters = ", ".join(
+            f"{key}={metrics[key]}"
+            for key in ["pending", "committed", "dropped", "failed", "spooled"]
+            if key in metrics
+        )
+        logger.info(
+            "Write-behind queue: %s; %d batches: %s",
+            counters,
+            metrics["batches"],
+            latencies or "no latency yet",
+        )
+        self._logged_at = time.monotonic()
+        self._logged_committed = self.committed
+
+    def close(self, timeout: float | None = 30.0):
+        """Stop accepting documents and flush the pending ones."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join(timeout)
+
+    def _next_batch(self) -> list:
+        """Wait for the next writes and collect up to batch_size writes."""
+        try:
+            writes = list(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return []
+        while len(writes) < self.batch_size:
+            try:
+                writes.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return writes
+
+    def _commit(self, writes: list):
+        """Commit a list of (collection, document, data) writes as a single batch."""
+        start = time.perf_counter()
+        self.storage.commit(writes)
+        self.latencies.append((time.perf_counter() - start, len(writes)))
+        self.committed += len(writes)
+
+    def _upload(self, writes: list):
+        """Upload a batch of writes directly, or through the spool."""
+        if self.spool is not None:
+            if writes:
+                self.spool.append(writes)
+            if self.storage is None or time.monotonic() < self._retry_at:
+                return
+            try:
+                replay(self.spool, self._commit, self.batch_size)
+            except Exception:
+                self._retry_at = time.monotonic() + self.retry_interval
+                logger.exception("Write-behind queue failed to replay the spool")
+            return
+        for start in range(0, len(writes), MAX_BATCH_SIZE):
+            chunk = writes[start : start + MAX_BATCH_SIZE]
+            try:
+                self._commit(chunk)
+            except Exception:
+                self.failed += len(chunk)
+                logger.exception(
+                    "Write-behind queue failed to commit %d documents", len(chunk)
+                )
+
+    def _run(self):
+        """Drain the queue until it is closed and empty."""
+        while not (self._closed.is_set() and self._queue.empty()):
+            writes = self._next_batch()
+            # With a spool, idle iterations retry the pending writes
+            if writes or self.spool is not None:
+                self._upload(writes)
+            if (
+                self.committed != self._logged_committed
+                and time.monotonic() - self._logged_at >= self.metrics_interval
+            ):
+                self.log_metrics()
+        if self.spool is not None:
+            self._retry_at = 0.0
+            self._upload([])
+        self.log_metrics()
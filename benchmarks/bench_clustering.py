@@ -0,0 +1,67 @@
+"""
+Benchmark of the DSM clustering on synthetic block-structured DSMs.
+
+Usage:
+    python benchmarks/bench_clustering.py [clusters x size ...]
+
+e.g. python benchmarks/bench_clustering.py 20x25 100x50
+"""
+
+import os
+import sys
+import time
+from math import comb
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from clustering import Clustering, synthetic  # noqa: E402
+
+
+def adjusted_rand(labels: np.ndarray, truth: np.ndarray) -> float:
+    """Return the adjusted Rand index of two clusterings (1 if identical)."""
+    pairs = np.unique(np.stack([labels, truth]), axis=1, return_counts=True)[1]
+    same = sum(comb(int(count), 2) for count in pairs)
+    a = sum(comb(int(count), 2) for count in np.bincount(labels))
+    b = sum(comb(int(count), 2) for count in np.bincount(truth))
+    expected = a * b / comb(len(labels), 2)
+    return (same - expected) / ((a + b) / 2 - expected)
+
+
+cases = [tuple(map(int, arg.split("x"))) for arg in sys.argv[1:]] or [
+    (20, 25),
+    (100, 50),
+    (400, 50),
+]
+for clusters, size in cases:
+    dsm, truth = synthetic(clusters, size)
+    matrix = dsm.layer()
+    print(f"{clusters} clusters of {size}: {dsm.size} components, {dsm.nnz} marks")
+    reference = Clustering(matrix, truth)
+    print(f"  {'true clusters':<18} {reference.cost():10.3g} cost, {reference}")
+
+    methods = {
+        "markov": lambda: Clustering.markov(matrix),
+        "annealed": lambda: Clustering.annealed(matrix),
+    }
+    markov = None
+    for name, method in methods.items():
+        start = time.perf_counter()
+        clustering = method()
+        elapsed = time.perf_counter() - start
+        markov = markov if markov is not None else clustering
+        print(
+            f"  {name:<18} {clustering.cost():10.3g} cost, "
+            f"ARI {adjusted_rand(clustering.labels, truth):.3f}, {elapsed:6.2f} s, "
+            f"{clustering.count} clusters"
+        )
+
+    start = time.perf_counter()
+    refined = Clustering.annealed(matrix, markov.labels)
+    elapsed = time.perf_counter() - start
+    print(
+        f"  {'markov + annealed':<18} {refined.cost():10.3g} cost, "
+        f"ARI {adjusted_rand(refined.labels, truth):.3f}, {elapsed:6.2f} s, "
+        f"{refined.count} clusters"
+    )
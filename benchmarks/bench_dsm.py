@@ -0,0 +1,53 @@
+"""
+Benchmark of the sparse DSM on synthetic DSMs of 10k+ components.
+
+Usage:
+    python benchmarks/bench_dsm.py [size ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from dsm import DSM  # noqa: E402
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 50_000]
+for size in sizes:
+    start = time.perf_counter()
+    dsm = DSM.synthetic(size)
+    build = time.perf_counter() - start
+    memory = sum(
+        layer.data.nbytes + layer.indices.nbytes + layer.indptr.nbytes
+        for layer in dsm.layers.values()
+    )
+    print(f"{dsm}: built in {build:.3f} s, {memory / 1e6:.1f} MB")
+    print(f"  dense kind matrix would be {size * size * 4 / 1e6:.0f} MB (U1)")
+
+    start = time.perf_counter()
+    dsm.degree(direction="both")
+    print(f"  degree (both directions): {time.perf_counter() - start:.4f} s")
+
+    start = time.perf_counter()
+    dsm.degree(["M", "H"])
+    print(f"  degree (M+H union): {time.perf_counter() - start:.4f} s")
+
+    rng = np.random.default_rng(0)
+    queries = rng.integers(0, size, 10_000)
+    start = time.perf_counter()
+    for i in queries:
+        dsm.neighbors(i, direction="both")
+    print(f"  10k neighbor queries: {time.perf_counter() - start:.4f} s")
+
+    system = np.sort(rng.choice(size, size // 3, replace=False))
+    start = time.perf_counter()
+    dsm.submatrix(system)
+    elapsed = time.perf_counter() - start
+    print(f"  submatrix of {len(system)} components: {elapsed:.4f} s")
+
+    start = time.perf_counter()
+    dsm.filter("M") | dsm.filter("EH")
+    print(f"  union of two filtered DSMs: {time.perf_counter() - start:.4f} s")
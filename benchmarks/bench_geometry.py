@@ -0,0 +1,52 @@
+"""
+Benchmark of the component geometry on synthetic assemblies.
+
+Usage:
+    python benchmarks/bench_geometry.py [size ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from geometry import Geometry  # noqa: E402
+
+Geometry.synthetic(10).tree  # import scipy before timing
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000]
+for size in sizes:
+    geometry = Geometry.synthetic(size)
+
+    print(geometry)
+    if size <= 20_000:
+        start = time.perf_counter()
+        condensed = geometry.condensed
+        elapsed = time.perf_counter() - start
+        print(f"  condensed distances in {elapsed:.3f} s")
+        print(
+            f"  {condensed.nbytes / 1e6:.0f} MB condensed float32, "
+            f"{size * size * 8 / 1e6:.0f} MB as a square float64 matrix"
+        )
+    else:
+        print("  condensed distances skipped (radius queries only)")
+
+    start = time.perf_counter()
+    geometry.tree
+    print(f"  KD-tree built in {time.perf_counter() - start:.4f} s")
+
+    rng = np.random.default_rng(0)
+    queries = rng.integers(0, size, 10_000)
+    start = time.perf_counter()
+    found = sum(len(geometry.within(i, 250.0)) for i in queries)
+    elapsed = time.perf_counter() - start
+    print(f"  10k radius queries (250 mm, {found} found): {elapsed:.4f} s")
+
+    start = time.perf_counter()
+    center = geometry.positions[queries[0]]
+    brute = np.flatnonzero(np.linalg.norm(geometry.positions - center, axis=1) <= 250)
+    print(f"  one brute-force query: {time.perf_counter() - start:.6f} s")
+    assert set(brute) - {queries[0]} == set(geometry.within(queries[0], 250.0))
@@ -0,0 +1,40 @@
+"""
+Benchmark of the level-of-detail heatmaps on synthetic DSMs.
+
+Usage:
+    python benchmarks/bench_heatmap.py [size ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from dsm import DSM  # noqa: E402
+from heatmap import Pyramid  # noqa: E402
+
+Pyramid.from_dsm(DSM.synthetic(100)).figure().to_json()  # import plotly first
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 50_000, 200_000]
+for size in sizes:
+    dsm = DSM.synthetic(size)
+    start = time.perf_counter()
+    pyramid = Pyramid.from_dsm(dsm)
+    print(f"{pyramid}: built in {time.perf_counter() - start:.3f} s")
+
+    views = {
+        "overview": (None, None),
+        "zoom 2000": ((size // 2, size // 2 + 2000), (size // 2, size // 2 + 2000)),
+        "zoom 40": ((size // 2, size // 2 + 40), (size // 2, size // 2 + 40)),
+    }
+    for name, (rows, cols) in views.items():
+        start = time.perf_counter()
+        figure = pyramid.figure(rows, cols)
+        payload = figure.to_json()
+        elapsed = time.perf_counter() - start
+        cells = figure.data[0].z.shape
+        print(
+            f"  {name}: {cells[0]} x {cells[1]} blocks, {elapsed * 1000:.0f} ms, "
+            f"{len(payload) / 1e3:.0f} kB"
+        )
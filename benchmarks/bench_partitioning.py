@@ -0,0 +1,47 @@
+"""
+Benchmark of the DSM partitioning on synthetic DSMs of 50k+ marks.
+
+Usage:
+    python benchmarks/bench_partitioning.py [size ...]
+"""
+
+import os
+import sys
+import time
+
+from scipy.sparse.csgraph import connected_components
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from dsm import DSM  # noqa: E402
+from partitioning import Partition  # noqa: E402
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 50_000, 200_000]
+for size in sizes:
+    # About 5 marks per component: 50k marks for 10k components
+    dsm = DSM.synthetic(size, degree=5.0)
+    matrix = dsm.layer()
+
+    start = time.perf_counter()
+    partition = Partition(matrix)
+    elapsed = time.perf_counter() - start
+    print(f"{dsm.size} components, {matrix.nnz} marks: {partition}")
+    print(f"  partitioned in {elapsed:.3f} s")
+
+    # Same blocks as scipy's strongly connected components
+    count, labels = connected_components(matrix, directed=True, connection="strong")
+    assert count == partition.count
+    assert len(set(zip(partition.labels, labels))) == count
+
+    # No feedback between blocks
+    rows, cols = matrix.nonzero()
+    between = partition.labels[rows] != partition.labels[cols]
+    positions = partition.positions
+    assert not (positions[cols[between]] > positions[rows[between]]).any()
+
+    native = int((cols > rows).sum())
+    print(f"  feedback marks: {native} in the native order, {partition.feedback()}")
+
+    start = time.perf_counter()
+    partition.apply_dsm(dsm)
+    print(f"  reordered the DSM in {time.perf_counter() - start:.3f} s")